@@ -0,0 +1,617 @@
+'''
+Requirements: Pillow
+
+Builds animated GIFs from sequences of images. Giffer is the engine
+behind guigif.py; run this file directly to build animations without
+the GUI, e.g. on a cluster node. PyQt5 is never imported.
+
+The output format follows the destination's extension: .gif, .webp
+(animated WebP, needs Pillow built with libwebp) or .png/.apng (animated
+PNG). WebP and APNG keep full colour, so frames are not quantized.
+
+Several animations are built at once in parallel worker processes.
+Pass one --source glob per animation, each followed by its --destination.
+
+Usage: argparse-based
+
+> python giffer.py -s 'run1/*.tif' -d run1.gif -s 'run2/*.tif' -d run2.gif --duration 50
+
+'''
+
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+from io import BytesIO
+import itertools
+import os
+import sys
+import zlib
+from PIL import Image, ImageChops, GifImagePlugin
+
+TRANSPARENT = 255 # palette index left free in every frame for unchanged pixels
+
+FORMATS = {'.gif': 'GIF', '.webp': 'WEBP', '.png': 'APNG', '.apng': 'APNG'}
+
+# Pillow major versions whose private WebP animation encoder write_webp calls
+WEBP_ENCODER_VERSIONS = (11, 12)
+
+
+class Giffer():
+	def __init__(self):
+		self.source_files = []
+		self.destination = ''
+		self.frame_duration = 24
+		self.loops = 0
+		# self.sort = None
+		self.exclusion_criteria = None
+		self.global_palette = False
+		self.workers = os.cpu_count() or 1
+		self.max_size = None
+		self.lossless = False
+		self.quality = 80
+		self.method = 4
+
+	def set_source_files(self, source_files):
+		self.source_files = source_files
+
+	def get_source_files(self):
+		return self.source_files
+
+	def set_destination(self, destination):
+		self.destination = destination
+
+	def get_destination(self):
+		return self.destination
+
+	def set_frame_duration(self, frame_duration):
+		frame_duration = int(frame_duration)
+
+		assert frame_duration > 0, 'frame duration must be positive'
+		self.frame_duration = frame_duration
+
+	def get_frame_duration(self):
+		return self.frame_duration
+
+	def set_loops(self, loops):
+		loops = int(loops)
+
+		assert loops > -1, 'loops must be 0 or positive integer'
+		self.loops = loops
+
+	def get_loops(self):
+		return self.loops
+
+	# def set_sort_lambda(self, sort_lambda):
+	# 	self.sort = sort_lambda
+
+	# def get_sort_lambda(self):
+	# 	return str(self.sort)
+
+	def set_exclusion_criteria(self, exclusion_criteria):
+		self.exclusion_criteria = exclusion_criteria
+
+	def get_exclusion_criteria(self):
+		return self.exclusion_criteria
+
+	def set_global_palette(self, global_palette):
+		self.global_palette = bool(global_palette)
+
+	def get_global_palette(self):
+		return self.global_palette
+
+	def set_workers(self, workers):
+		workers = int(workers)
+
+		assert workers > 0, 'number of workers must be positive'
+		self.workers = workers
+
+	def get_workers(self):
+		return self.workers
+
+	def set_max_size(self, max_size):
+		max_size = int(max_size)
+
+		assert max_size > -1, 'maximum size must be 0 or positive integer'
+		self.max_size = max_size or None
+
+	def get_max_size(self):
+		return self.max_size
+
+	def set_lossless(self, lossless):
+		self.lossless = bool(lossless)
+
+	def get_lossless(self):
+		return self.lossless
+
+	def set_quality(self, quality):
+		quality = int(quality)
+
+		assert 0 <= quality <= 100, 'quality must be between 0 and 100'
+		self.quality = quality
+
+	def get_quality(self):
+		return self.quality
+
+	def set_method(self, method):
+		method = int(method)
+
+		assert 0 <= method <= 6, 'method must be between 0 (fast) and 6 (small)'
+		self.method = method
+
+	def get_method(self):
+		return self.method
+
+	def get_format(self):
+		ext = os.path.splitext(self.destination)[1].lower()
+		if ext not in FORMATS:
+			raise ValueError(f'unknown animation format {ext}')
+
+		return FORMATS[ext]
+
+	def included_files(self):
+		if not self.exclusion_criteria:
+			return list(self.source_files)
+
+		return [file for file in self.source_files if self.exclusion_criteria not in file.split(os.sep)[-1]]
+
+	def frames(self, mode='P'):
+		# source images are opened and released one at a time, and converted
+		# frames are released as soon as they have been written
+		files = self.included_files()
+
+		palette = None
+		if self.global_palette and mode == 'P':
+			palette = build_palette(files)
+
+		if self.workers == 1:
+			for file in files:
+				yield load_frame(file, palette, self.max_size, mode)
+			return
+
+		# quantize in parallel, but only a couple of frames per worker ahead
+		# of the writer so memory doesn't grow with the length of the sequence
+		files = iter(files)
+		with ProcessPoolExecutor(max_workers=self.workers) as pool:
+			pending = deque(pool.submit(load_frame, file, palette, self.max_size, mode)
+				for _, file in zip(range(2*self.workers), files))
+
+			while pending:
+				frame = pending.popleft().result()
+				for file in files:
+					pending.append(pool.submit(load_frame, file, palette, self.max_size, mode))
+					break
+				yield frame
+
+	def make_gif(self, progress=None, cancelled=None):
+		'''
+		progress(done, total) is called after each frame is read. If
+		cancelled() returns True between frames, the partial file is
+		removed and no more frames are read.
+		'''
+
+		if not self.source_files:
+			return False, 'No source specified'
+
+		# if self.sort:
+		# 	sort_func = lambda file : eval(self.sort)
+		# 	self.source_files.sort(key=sort_func)
+
+		n_frames = len(self.included_files())
+		if not n_frames:
+			return False, 'All source files excluded'
+
+		stopped = False
+		def tracked(frames):
+			nonlocal stopped
+			for i, frame in enumerate(frames):
+				if cancelled is not None and cancelled():
+					stopped = True
+					frames.close()
+					return
+				yield frame
+				if progress is not None:
+					progress(i+1, n_frames)
+
+		try:
+			fmt = self.get_format()
+		except ValueError:
+			return False, 'Cannot determine output format'
+
+		try:
+			with open(self.destination, 'wb') as fp:
+				if fmt == 'GIF':
+					write_gif(tracked(self.frames()), fp, self.frame_duration, self.loops,
+						local_palettes=not self.global_palette)
+				elif fmt == 'WEBP':
+					write_webp(tracked(self.frames('RGB')), fp, self.frame_duration, self.loops,
+						self.lossless, self.quality, self.method)
+				else:
+					# grayscale sources stay grayscale, a third the size of RGB
+					mode = frame_mode(self.included_files()[0])
+					write_apng(tracked(self.frames(mode)), fp, self.frame_duration, self.loops)
+		except ValueError as e:
+			return False, str(e)
+		except OSError:
+			return False, 'File could not be written'
+
+		if stopped:
+			os.remove(self.destination)
+			return False, 'Cancelled'
+
+		return True, f'Successfully created {fmt.lower()}'
+
+
+def palette_image(palette):
+	img = Image.new('P', (1, 1))
+	img.putpalette(palette)
+	return img
+
+
+def build_palette(files, n_samples=16, sample_size=256):
+	'''
+	Computes one 255 color palette for a whole sequence from a montage of
+	thumbnails of evenly spaced frames. Quantizing every frame to the same
+	palette keeps colors from flickering between frames.
+	'''
+	n_samples = min(n_samples, len(files))
+	samples = [files[i * (len(files)-1) // max(1, n_samples-1)] for i in range(n_samples)]
+
+	thumbnails = []
+	for file in samples:
+		with Image.open(file) as img:
+			img.draft('RGB', (sample_size, sample_size))
+			thumbnail = img.convert('RGB')
+		thumbnail.thumbnail((sample_size, sample_size))
+		thumbnails.append(thumbnail)
+
+	montage = Image.new('RGB', (sample_size, sample_size * len(thumbnails)))
+	for i, thumbnail in enumerate(thumbnails):
+		montage.paste(thumbnail, (0, i * sample_size))
+
+	# unused montage background shouldn't take palette entries
+	montage = montage.crop((0, 0, max(t.width for t in thumbnails), montage.height))
+
+	return montage.quantize(colors=255, method=Image.Quantize.MEDIANCUT).getpalette()
+
+
+def frame_mode(file):
+	with Image.open(file) as img:
+		return 'L' if Image.getmodebase(img.mode) == 'L' else 'RGB'
+
+
+def load_frame(file, palette=None, max_size=None, mode='P'):
+	with Image.open(file) as img:
+		if max_size:
+			# shrink while decoding where the format allows it: JPEG decodes
+			# at 1/2, 1/4 or 1/8 scale with draft, others are reduced by
+			# an integer factor before the final resample
+			img.draft('RGB', (max_size, max_size))
+			img.thumbnail((max_size, max_size), reducing_gap=2.0)
+
+		if mode == 'P':
+			return gif_frame(img, palette)
+		else:
+			return img.convert(mode)
+
+
+def gif_frame(img, palette=None):
+	# GIF frames are palette images. Without a shared palette, every frame gets
+	# its own. Palettes have 255 colors so TRANSPARENT is always free
+	if palette is not None:
+		return img.convert('RGB').quantize(palette=palette_image(palette))
+	elif Image.getmodebase(img.mode) == 'RGB' or img.mode == 'P':
+		return img.convert('RGB').convert('P', palette=Image.Palette.ADAPTIVE, colors=255)
+	else:
+		return img.convert('L').convert('P', palette=Image.Palette.ADAPTIVE, colors=255)
+
+
+def changed_pixels(frame, previous):
+	'''
+	Compares an RGB or L frame with the one shown before it. Palette frames
+	are compared in RGB since they may have different palettes. Returns the
+	bounding box of the pixels that changed, or None if none did, and a
+	mask of the unchanged pixels.
+	'''
+	if previous is None or frame.size != previous.size:
+		return (0, 0) + frame.size, None
+
+	diff = ImageChops.difference(frame, previous)
+	bbox = diff.getbbox()
+	if bbox is None:
+		return None, None
+
+	changed, *bands = diff.crop(bbox).split()
+	for band in bands:
+		changed = ImageChops.lighter(changed, band)
+	unchanged = changed.point(lambda value : 0 if value else 255, mode='1')
+
+	return bbox, unchanged
+
+
+def write_gif(frames, fp, duration, loops, local_palettes=True):
+	'''
+	Writes an animated GIF one frame at a time, so only the frame being
+	encoded and the one before it are ever held in memory. Pillow's
+	save(append_images=...) keeps every converted frame until the end of the file.
+
+	Frames after the first only store the rectangle that changed since the
+	previous frame, with unchanged pixels inside it transparent. Repeated
+	frames are dropped and the previous frame is shown for longer instead.
+
+	The first frame's palette is the global color table. With local_palettes,
+	every later frame carries its own color table, otherwise they all share
+	the global one.
+	'''
+	previous = None # RGB of the frame currently shown
+	pending = None # frame waiting to be written until its duration is known
+
+	def write(frame, offset, frame_duration, params):
+		for data in GifImagePlugin.getdata(frame, offset, duration=frame_duration, **params):
+			fp.write(data)
+
+	for i, frame in enumerate(frames):
+		rgb = frame.convert('RGB')
+		bbox, unchanged = changed_pixels(rgb, previous)
+		previous = rgb
+
+		if bbox is None:
+			pending[2] += duration
+			continue
+
+		if pending is not None:
+			write(*pending)
+
+		if i == 0:
+			header, _ = GifImagePlugin.getheader(frame, info={'loop': loops, 'duration': duration})
+			fp.write(b''.join(header))
+			pending = [frame, (0, 0), duration, {'disposal': 1}]
+			continue
+
+		delta = frame.crop(bbox)
+		params = {'include_color_table': local_palettes, 'disposal': 1}
+		if unchanged is not None:
+			delta.paste(TRANSPARENT, mask=unchanged)
+			params['transparency'] = TRANSPARENT
+		pending = [delta, bbox[:2], duration, params]
+
+	if pending is not None:
+		write(*pending)
+
+	fp.write(b';')
+
+
+def webp_encoder():
+	'''
+	Pillow's private libwebp animation encoder, if this Pillow is one whose
+	encoder write_webp knows how to call, otherwise None.
+	'''
+	try:
+		from PIL import _webp
+		major = int(Image.__version__.split('.')[0])
+	except (ImportError, ValueError):
+		return None
+
+	if not WEBP_ENCODER_VERSIONS[0] <= major <= WEBP_ENCODER_VERSIONS[1]:
+		return None
+	return getattr(_webp, 'WebPAnimEncoder', None)
+
+
+def write_webp(frames, fp, duration, loops, lossless=False, quality=80, method=4):
+	'''
+	Writes an animated WebP one frame at a time. Pillow's save(append_images=...)
+	makes a list of every frame first, so this drives its libwebp animation
+	encoder directly. The encoder itself crops frames to the changed
+	rectangle and merges repeated frames. Pillows with a different encoder
+	go through save() instead.
+	'''
+	encoder = webp_encoder()
+	if encoder is None:
+		return save_webp(frames, fp, duration, loops, lossless, quality, method)
+
+	enc = None
+	timestamp = 0
+	for frame in frames:
+		if enc is None:
+			# kmin/kmax keyframe spacing defaults as in gif2webp and Pillow
+			kmin, kmax = (9, 17) if lossless else (3, 5)
+			try:
+				enc = encoder(frame.size, 0, loops, False, kmin, kmax, False, False)
+				enc.add(frame.getim(), timestamp, lossless, quality, 100, method)
+			except TypeError:
+				# the encoder's arguments have changed
+				return save_webp(itertools.chain([frame], frames), fp, duration, loops,
+					lossless, quality, method)
+			size = frame.size
+			timestamp += duration
+			continue
+		elif frame.size != size:
+			raise ValueError('All frames must be the same size for WebP')
+
+		enc.add(frame.getim(), timestamp, lossless, quality, 100, method)
+		timestamp += duration
+
+	if enc is None:
+		return
+
+	enc.add(None, timestamp, lossless, quality, 100, 0)
+	data = enc.assemble('', b'', '')
+	if data is None:
+		raise OSError('cannot write file as WebP')
+
+	fp.write(data)
+
+
+def save_webp(frames, fp, duration, loops, lossless=False, quality=80, method=4):
+	# the public route, which holds every frame in memory until it's written
+	frames = list(frames)
+	if not frames:
+		return
+	if any(frame.size != frames[0].size for frame in frames):
+		raise ValueError('All frames must be the same size for WebP')
+
+	frames[0].save(fp, format='WEBP', save_all=True, append_images=frames[1:],
+		duration=duration, loop=loops, lossless=lossless, quality=quality, method=method)
+
+
+def png_chunks(data):
+	pos = 8 # skip signature
+	while pos < len(data):
+		length = int.from_bytes(data[pos:pos+4], 'big')
+		yield data[pos+4:pos+8], data[pos+8:pos+8+length]
+		pos += length + 12
+
+
+def write_png_chunk(fp, chunk_type, data):
+	fp.write(len(data).to_bytes(4, 'big') + chunk_type + data
+		+ zlib.crc32(chunk_type + data).to_bytes(4, 'big'))
+
+
+def write_apng(frames, fp, duration, loops, compress_level=6):
+	'''
+	Writes an animated PNG one frame at a time. Pillow's APNG writer keeps
+	every frame until the end of the file, so each frame is encoded as a
+	plain PNG and its image data copied into the animation. As with GIF,
+	later frames only store the rectangle that changed, and repeated
+	frames are merged into a longer one.
+	'''
+	previous = None
+	pending = None # [frame, offset, duration] waiting until its duration is known
+	sequence = 0
+	n_frames = 0
+	actl_pos = None
+
+	def write(frame, offset, frame_duration):
+		nonlocal sequence, n_frames, actl_pos
+
+		buf = BytesIO()
+		frame.save(buf, format='PNG', compress_level=compress_level)
+		chunks = list(png_chunks(buf.getvalue()))
+
+		if n_frames == 0:
+			write_png_chunk(fp, b'IHDR', chunks[0][1])
+			actl_pos = fp.tell()
+			write_png_chunk(fp, b'acTL', bytes(8)) # frame count filled in at the end
+
+		# delay is a 16 bit fraction of a second, long merged frames need a coarser unit
+		delay, unit = frame_duration, 1000
+		while delay > 0xffff and unit > 1:
+			delay, unit = delay // 10, unit // 10
+
+		# frame control: size, offset, delay, no disposal, replace the region
+		write_png_chunk(fp, b'fcTL', b''.join(n.to_bytes(4, 'big') for n in
+			[sequence, frame.width, frame.height, offset[0], offset[1]])
+			+ min(delay, 0xffff).to_bytes(2, 'big') + unit.to_bytes(2, 'big') + bytes(2))
+		sequence += 1
+
+		data = b''.join(data for chunk_type, data in chunks if chunk_type == b'IDAT')
+		if n_frames == 0:
+			write_png_chunk(fp, b'IDAT', data)
+		else:
+			write_png_chunk(fp, b'fdAT', sequence.to_bytes(4, 'big') + data)
+			sequence += 1
+
+		n_frames += 1
+
+	fp.write(b'\x89PNG\r\n\x1a\n')
+	for frame in frames:
+		bbox, _ = changed_pixels(frame, previous)
+		previous = frame
+
+		if bbox is None:
+			pending[2] += duration
+			continue
+
+		if pending is not None:
+			write(*pending)
+
+		pending = [frame.crop(bbox), bbox[:2], duration]
+
+	if pending is None:
+		return
+
+	write(*pending)
+	write_png_chunk(fp, b'IEND', b'')
+
+	end = fp.tell()
+	fp.seek(actl_pos)
+	write_png_chunk(fp, b'acTL', n_frames.to_bytes(4, 'big') + loops.to_bytes(4, 'big'))
+	fp.seek(end)
+
+
+# ---------- Batch mode ----------------------------------------
+
+def find_files(pattern):
+	if '~' in pattern:
+		pattern = pattern.replace('~', os.environ['HOME'])
+
+	files = glob.glob(pattern)
+
+	return sorted(files)
+
+
+def make_animation(sources, destination, options, workers=1):
+	giffer = Giffer()
+	giffer.set_source_files(find_files(sources))
+	giffer.set_destination(destination)
+	giffer.set_frame_duration(options.duration)
+	giffer.set_loops(options.loops)
+	giffer.set_exclusion_criteria(options.exclude)
+	giffer.set_global_palette(options.global_palette)
+	giffer.set_max_size(options.max_size)
+	giffer.set_lossless(options.lossless)
+	giffer.set_quality(options.quality)
+	giffer.set_method(options.method)
+	giffer.set_workers(workers)
+
+	return giffer.make_gif()
+
+
+def main(options):
+	jobs = options.jobs or os.cpu_count() or 1
+	animations = list(zip(options.source, options.destination))
+
+	if len(animations) == 1 or jobs == 1:
+		# one animation at a time, its frames are quantized in parallel instead
+		results = [(destination, make_animation(source, destination, options, jobs))
+			for source, destination in animations]
+	else:
+		results = []
+		with ProcessPoolExecutor(max_workers=jobs) as pool:
+			futures = {pool.submit(make_animation, source, destination, options): destination
+				for source, destination in animations}
+
+			for future in as_completed(futures):
+				results.append((futures[future], future.result()))
+
+	failed = False
+	for destination, (success, message) in results:
+		print(f'{destination}: {message}')
+		failed = failed or not success
+
+	return failed
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Build animated GIFs from image sequences')
+
+	parser.add_argument('-s', '--source', action='append', required=True, help='glob of frames for one animation. Repeat for each animation')
+	parser.add_argument('-d', '--destination', action='append', required=True, help='output file for the matching --source')
+
+	parser.add_argument('--duration', type=int, default=24, help='frame duration in ms')
+	parser.add_argument('--loops', type=int, default=0, help='number of loops, 0 is infinite')
+	parser.add_argument('--exclude', default='', help='skip files with this in their name')
+	parser.add_argument('--global_palette', action='store_true', help='use one palette for all frames of an animation')
+	parser.add_argument('--max_size', type=int, default=0, help='maximum width/height of frames in px, 0 is original size')
+	parser.add_argument('--lossless', action='store_true', help='lossless webp frames')
+	parser.add_argument('--quality', type=int, default=80, help='webp quality, 0-100')
+	parser.add_argument('--method', type=int, default=4, help='webp effort, 0 (fast) to 6 (small)')
+	parser.add_argument('-j', '--jobs', type=int, help='number of worker processes. Defaults to number of cpus')
+
+	args = parser.parse_args()
+
+	if len(args.source) != len(args.destination):
+		parser.error('each --source needs a matching --destination')
+
+	sys.exit(main(args))
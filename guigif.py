@@ -1,84 +1,31 @@
-import sys, os
-from PIL import Image
+import sys
+
+from giffer import Giffer
 
 from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 
 
-class Giffer():
-	def __init__(self):
-		self.source_files = []
-		self.destination = ''
-		self.frame_duration = 24
-		self.loops = 0
-		# self.sort = None
-		self.exclusion_criteria = None
-
-	def set_source_files(self, source_files):
-		self.source_files = source_files
-
-	def get_source_files(self):
-		return self.source_files
-
-	def set_destination(self, destination):
-		self.destination = destination
-
-	def get_destination(self):
-		return self.destination
-
-	def set_frame_duration(self, frame_duration):
-		frame_duration = int(frame_duration)
-
-		assert frame_duration > 0, 'frame duration must be positive'
-		self.frame_duration = frame_duration
-
-	def get_frame_duration(self):
-		return self.frame_duration
-
-	def set_loops(self, loops):
-		loops = int(loops)
-
-		assert loops > -1, 'loops must be 0 or positive integer'
-		self.loops = loops
-
-	def get_loops(self):
-		return self.loops
-
-	# def set_sort_lambda(self, sort_lambda):
-	# 	self.sort = sort_lambda
-
-	# def get_sort_lambda(self):
-	# 	return str(self.sort)
-
-	def set_exclusion_criteria(self, exclusion_criteria):
-		self.exclusion_criteria = exclusion_criteria
-
-	def get_exclusion_criteria(self):
-		return self.exclusion_criteria
-
-	def make_gif(self):
-
-		if not self.source_files:
-			return False, 'No source specified'
-
-		# if self.sort:
-		# 	sort_func = lambda file : eval(self.sort)
-		# 	self.source_files.sort(key=sort_func)
-
+class GifWorker(QThread):
+	progress = pyqtSignal(int, int)
+	done = pyqtSignal(bool, str)
 
+	def __init__(self, giffer):
+		super().__init__()
 
-		img, *imgs = [Image.open(file) for file in self.source_files if self.exclusion_criteria not in file.split(os.sep)[-1]]
+		self.giffer = giffer
 
+	def run(self):
+		# always report back, or the progress dialog stays up and make stays disabled
+		success, message = False, 'GIF could not be made'
 		try:
-			img.save(fp=self.destination, format='GIF', append_images=imgs,
-				save_all=True, duration=self.frame_duration, loop=self.loops)
-		except ValueError:
-			return False, 'Cannot determine output format'
-		except OSError:
-			return False, 'File could not be written'
-
-		return True, 'Successfully created gif'
+			success, message = self.giffer.make_gif(progress=self.progress.emit,
+				cancelled=self.isInterruptionRequested)
+		except Exception as e:
+			message = f'GIF could not be made: {e!r}'
+		finally:
+			self.done.emit(success, message)
 
 
 class MainWindow(QMainWindow):
@@ -88,6 +35,7 @@ class MainWindow(QMainWindow):
 		self.title = 'Gifify'
 
 		self.giffer = Giffer()
+		self.worker = None
 
 		self.init_UI()
 
@@ -105,6 +53,7 @@ class MainWindow(QMainWindow):
 		b1.clicked.connect(lambda : self.open_source())
 		b2.clicked.connect(lambda : self.choose_destination())
 		b3.clicked.connect(lambda : self.go())
+		self.make_button = b3
 
 		centralLayout.addWidget(b1, 0,0)
 		centralLayout.addWidget(b2, 0,1)
@@ -133,9 +82,31 @@ class MainWindow(QMainWindow):
 			self.giffer.set_destination(destination)
 
 	def go(self):
-		success, message = self.giffer.make_gif()
+		if self.worker is not None:
+			return
+
+		self.progress = QProgressDialog('Making GIF...', 'Cancel', 0, 0, self)
+		self.progress.setWindowModality(Qt.WindowModal)
+		self.progress.setMinimumDuration(0)
+
+		# encode off the GUI thread so the window stays responsive
+		self.worker = GifWorker(self.giffer)
+		self.worker.progress.connect(self.update_progress)
+		self.worker.done.connect(self.finished)
+		self.progress.canceled.connect(self.worker.requestInterruption)
 
-		# if success
+		self.make_button.setEnabled(False)
+		self.worker.start()
+
+	def update_progress(self, done, total):
+		self.progress.setMaximum(total)
+		self.progress.setValue(done)
+
+	def finished(self, success, message):
+		self.worker.wait()
+		self.worker = None
+		self.progress.reset()
+		self.make_button.setEnabled(True)
 
 		self.user_message(message)
 
@@ -164,9 +135,12 @@ class MainWindow(QMainWindow):
 	def save_file_dialog(self):
 		options = QFileDialog.Options()
 		options |= QFileDialog.DontUseNativeDialog
-		filename, qfilter = QFileDialog.getSaveFileName(self,"Save File","","Graphics Interchange Format (*.gif)", options=options)
+		filename, qfilter = QFileDialog.getSaveFileName(self,"Save File","",
+			"Graphics Interchange Format (*.gif);;Animated WebP (*.webp);;Animated PNG (*.png)", options=options)
 		if filename:
-			filename += qfilter[-5:-1]
+			ext = qfilter.split('*')[-1][:-1]
+			if not filename.lower().endswith(ext):
+				filename += ext
 			return filename
 		else:
 			return None
@@ -241,6 +215,76 @@ class AdvancedSettings(QWidget):
 		self.exclusion_criteria = x_value
 
 
+		# global palette
+		palette_value = QCheckBox('Use one palette for all frames')
+		palette_value.setChecked(self.parent.giffer.get_global_palette())
+
+		self.layout.addWidget(palette_value)
+		self.global_palette = palette_value
+
+
+		# worker processes
+		workers_w = QWidget(self)
+		workers_l = QHBoxLayout(workers_w)
+		w_label = QLabel('Worker processes')
+		w_value = QLineEdit()
+		text = str(self.parent.giffer.get_workers())
+		w_value.setText(text)
+		w_value.setValidator(QIntValidator())
+		workers_l.addWidget(w_label)
+		workers_l.addWidget(w_value)
+
+		self.layout.addWidget(workers_w)
+		self.workers_value = w_value
+
+
+		# maximum frame size
+		size_w = QWidget(self)
+		size_l = QHBoxLayout(size_w)
+		m_label = QLabel('Maximum width/height (px)\n(0 is original size)')
+		m_value = QLineEdit()
+		text = str(self.parent.giffer.get_max_size() or 0)
+		m_value.setText(text)
+		m_value.setValidator(QIntValidator())
+		size_l.addWidget(m_label)
+		size_l.addWidget(m_value)
+
+		self.layout.addWidget(size_w)
+		self.max_size_value = m_value
+
+
+		# webp encoding
+		lossless_value = QCheckBox('Lossless WebP')
+		lossless_value.setChecked(self.parent.giffer.get_lossless())
+
+		self.layout.addWidget(lossless_value)
+		self.lossless = lossless_value
+
+		quality_w = QWidget(self)
+		quality_l = QHBoxLayout(quality_w)
+		q_label = QLabel('WebP quality (0-100)')
+		q_value = QLineEdit()
+		q_value.setText(str(self.parent.giffer.get_quality()))
+		q_value.setValidator(QIntValidator(0, 100))
+		quality_l.addWidget(q_label)
+		quality_l.addWidget(q_value)
+
+		self.layout.addWidget(quality_w)
+		self.quality_value = q_value
+
+		method_w = QWidget(self)
+		method_l = QHBoxLayout(method_w)
+		e_label = QLabel('WebP method\n(0 is fast, 6 is small)')
+		e_value = QLineEdit()
+		e_value.setText(str(self.parent.giffer.get_method()))
+		e_value.setValidator(QIntValidator(0, 6))
+		method_l.addWidget(e_label)
+		method_l.addWidget(e_value)
+
+		self.layout.addWidget(method_w)
+		self.method_value = e_value
+
+
 
 		# apply and cancel buttons
 		actions_w = QWidget(self)
@@ -266,6 +310,12 @@ class AdvancedSettings(QWidget):
 
 		# self.parent.giffer.set_sort_lambda(self.sort_lambda.text())
 		self.parent.giffer.set_exclusion_criteria(self.exclusion_criteria.text())
+		self.parent.giffer.set_global_palette(self.global_palette.isChecked())
+		self.parent.giffer.set_workers(self.workers_value.text())
+		self.parent.giffer.set_max_size(self.max_size_value.text())
+		self.parent.giffer.set_lossless(self.lossless.isChecked())
+		self.parent.giffer.set_quality(self.quality_value.text())
+		self.parent.giffer.set_method(self.method_value.text())
 
 		self.close()
 
@@ -1,8 +1,27 @@
 '''
-Requirements: matplotlib, PyQt5
+Requirements: matplotlib, numpy, PyQt5
 
 Gui-based matplotlib plotting software for quick visualization of data.
 
+Files are parsed on background threads, several at once, so the window
+stays responsive while large files load. Select several files in the
+open dialog to plot them all.
+
+Files opened before are read back from a cache of parsed arrays in
+~/.cache/qtplot (memory mapped, so reopening a huge file is quick) as
+long as they haven't changed. The least recently used entries are removed
+once the cache grows past CACHE_LIMIT.
+
+Follow File plots a file that is still being written, e.g. an instrument
+log, and adds lines to the plot as they are appended. What's already in
+the file loads in the background like any other file, then only the new
+bytes are read on each update.
+
+Large datasets are decimated to what the axes can show at their pixel
+resolution and re-decimated from the full data whenever the view is
+zoomed or panned, so millions of points still redraw quickly. Saved
+figures always contain the full data.
+
 Usage: just launch it!
 
 > python qtplot.py
@@ -13,50 +32,121 @@ import sys
 
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QMenu, QInputDialog, 
 	QLineEdit, QVBoxLayout, QSizePolicy, QMessageBox, QWidget, QPushButton, 
-	QFileDialog, QFormLayout, QComboBox)
+	QFileDialog, QFormLayout, QComboBox, QProgressBar)
 from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import pyqtSlot
+from PyQt5.QtCore import (pyqtSlot, pyqtSignal, QObject, QRunnable, QThreadPool,
+	QTimer, QFileSystemWatcher)
 
 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
+import numpy as np
+import hashlib, json, os, threading, time
+
+
+# parsed files are kept here, up to CACHE_LIMIT bytes. Files smaller than
+# CACHE_MIN_SIZE parse quickly enough not to bother
+CACHE_DIR = os.path.expanduser('~/.cache/qtplot')
+CACHE_LIMIT = 4 << 30
+CACHE_MIN_SIZE = 1 << 20
 
+# ms between checks of a followed file for new lines
+FOLLOW_INTERVAL = 1000
+
+# linestyle and marker for each plot style
+LINE_STYLES = {'o': ('None', 'o'), '-': ('-', 'None'), '-o': ('-', 'o')}
 
 # ---------- Helper functions ----------------------------------
 
 def read_2d_file(filename):
-	x, y = [], []
 	delimiter = get_delimiter(filename)
+	# runs of spaces count as one delimiter
+	if delimiter == ' ':
+		delimiter = None
+
+	# skip header lines up to the first line that starts with a number
+	skip = 0
+	with open(filename) as f:
+		for line in f:
+			lineSplit = line.split(delimiter)
+			if lineSplit and is_number(lineSplit[0]):
+				break
+			skip += 1
+
+	try:
+		# numpy's C parser reads the whole block of numbers at once
+		data = np.loadtxt(filename, delimiter=delimiter, skiprows=skip, usecols=(0, 1), ndmin=2)
+	except ValueError:
+		# text or short rows further down, parse line by line
+		return read_2d_lines(filename, delimiter)
+
+	return data[:, 0], data[:, 1]
+
+def read_2d_lines(filename, delimiter):
+	x, y = [], []
 
 	with open(filename) as f:
 		for line in f:
 			lineSplit = line.split(delimiter)
 
-			if is_number(lineSplit[0]):
+			if lineSplit and is_number(lineSplit[0]):
 				x.append( float( lineSplit[0] ))
 				y.append( float( lineSplit[1] ))
 			else:
 				continue
 
-	return x, y
+	return np.array(x), np.array(y)
+
+def parse_2d_block(block, delimiter):
+	# the same as read_2d_file, for complete lines of a file in memory
+	lines = block.split(b'\n')
+	sep = None if delimiter is None else delimiter.encode()
+
+	skip = 0
+	for line in lines:
+		lineSplit = line.split(sep)
+		if lineSplit and is_number(lineSplit[0]):
+			break
+		skip += 1
+
+	if skip == len(lines):
+		return np.empty(0), np.empty(0)
+
+	try:
+		data = np.loadtxt(lines[skip:], delimiter=delimiter, usecols=(0, 1), ndmin=2)
+	except ValueError:
+		# a followed file can have lines that don't parse, skip them
+		x, y = [], []
+		for line in lines[skip:]:
+			lineSplit = line.split(sep)
+			if len(lineSplit) > 1 and is_number(lineSplit[0]) and is_number(lineSplit[1]):
+				x.append( float( lineSplit[0] ))
+				y.append( float( lineSplit[1] ))
+		return np.array(x), np.array(y)
+
+	return data[:, 0], data[:, 1]
 
 def get_delimiter(filename):
 	if '.csv' in filename:
 		delimiter = ','
 
-	elif '.txt' in filename:
+	else:
+		# files are read off the gui thread, so the delimiter can't be asked
+		# for. Guess it from the first few lines instead
 		with open(filename) as f:
-			line = f.readline()
+			lines = ''.join(f.readline() for i in range(10))
 
-		if '\t' in line:
+		if '\t' in lines:
 			delimiter = '\t'
-		elif ' ' in line:
+		elif ',' in lines and '.txt' not in filename:
+			delimiter = ','
+		elif ';' in lines:
+			delimiter = ';'
+		else:
 			delimiter = ' '
 
-	else:
-		delimiter = input('Please specify delimiter for %s:\n' % filename)
-
 	return delimiter
 
 def is_number(value):
@@ -66,8 +156,298 @@ def is_number(value):
 	except ValueError:
 		return False
 
+def decimate_line(x, y, xlim, width):
+	# x must be sorted. Keeps the first, last, lowest and highest point of
+	# every pixel column (M4), which rasterizes to the same line as all points
+	lo, hi = np.searchsorted(x, xlim)
+	# keep one point either side of the view so the line runs off the edges
+	x = x[max(lo - 1, 0):hi + 1]
+	y = y[max(lo - 1, 0):hi + 1]
+	n = len(x)
+
+	if n <= 4 * width:
+		return x, y
+
+	edges = np.linspace(xlim[0], xlim[1], width + 1)
+	starts = np.unique(np.r_[0, np.searchsorted(x, edges[1:-1])])
+	starts = starts[starts < n]
+	ends = np.r_[starts[1:], n] - 1
+	column = np.repeat(np.arange(len(starts)), ends - starts + 1)
+
+	keep = [starts, ends]
+	for extreme in [np.fmin.reduceat(y, starts), np.fmax.reduceat(y, starts)]:
+		# first point in each column that reaches the column's extreme
+		hits = np.flatnonzero(y == extreme[column])
+		first = np.r_[True, column[hits][1:] != column[hits][:-1]]
+		keep.append(hits[first])
+
+	keep = np.unique(np.concatenate(keep))
+	return x[keep], y[keep]
+
+def decimate_points(x, y, xlim, ylim, width, height, pad=0, connected=False):
+	# keeps one point per occupied pixel, in data order, so markers and
+	# lines through unsorted data cover the same pixels as all points.
+	# Points up to pad pixels outside the view still show part of their marker
+	if len(x) <= 4 * width:
+		return x, y
+
+	px = (x - xlim[0]) * (width / (xlim[1] - xlim[0])) + pad
+	py = (y - ylim[0]) * (height / (ylim[1] - ylim[0])) + pad
+	width, height = width + 2 * pad, height + 2 * pad
+	inside = (px >= 0) & (px <= width) & (py >= 0) & (py <= height)
+	keep = []
+
+	if connected:
+		# both ends of every segment that leaves the view or may cross it, so
+		# lines run off the edges to their neighbours, and the gaps at nans
+		crosses = ((np.fmin(px[1:], px[:-1]) <= width) & (np.fmax(px[1:], px[:-1]) >= 0)
+			& (np.fmin(py[1:], py[:-1]) <= height) & (np.fmax(py[1:], py[:-1]) >= 0)
+			& ~(inside[1:] & inside[:-1]))
+		ends = np.isnan(x) | np.isnan(y)
+		ends[1:] |= crosses
+		ends[:-1] |= crosses
+		keep.append(np.flatnonzero(ends))
+		inside &= ~ends
+
+	# points on the upper limits (e.g. the data's maximum) go in the last pixel
+	inside = np.flatnonzero(inside)
+	px = np.minimum(px[inside].astype(np.int64), width - 1)
+	py = np.minimum(py[inside].astype(np.int64), height - 1)
+	pixel = py * width + px
+	owner = np.full(width * height, -1, dtype=np.int64)
+	owner[pixel] = inside
+	keep.append(owner[owner >= 0])
+
+	keep = np.sort(np.concatenate(keep))
+	return x[keep], y[keep]
+
 # ---------- Program Classes -----------------------------------
 
+class FileFollower(QObject):
+	# reads lines appended to a file since the last check. Points are kept
+	# in buffers that double in size when full, so appending is amortized
+	# O(new lines) however long the file gets
+	appended = pyqtSignal(object, object, int)
+	restarted = pyqtSignal()
+	failed = pyqtSignal(str)
+
+	def __init__(self, filename, parent=None):
+		super().__init__(parent)
+		self.filename = filename
+		self.reset()
+
+		# the watcher reports changes straight away where the os supports
+		# it, the timer catches the rest (e.g. network drives). Neither does
+		# anything until start() is given the file's first read
+		self.watcher = QFileSystemWatcher([filename], self)
+		self.watcher.fileChanged.connect(lambda path : self.poll())
+		self.timer = QTimer(self)
+		self.timer.timeout.connect(self.poll)
+
+	def reset(self):
+		self.offset = 0
+		self.remainder = b''
+		self.delimiter = None
+		self.n = 0
+		self.x = np.empty(1024)
+		self.y = np.empty(1024)
+
+	def stop(self):
+		self.timer.stop()
+		if self.watcher.files():
+			self.watcher.removePaths(self.watcher.files())
+
+	def start(self, x, y):
+		# x and y are the file up to self.offset, read on the thread pool by a
+		# FileLoader so a large file doesn't hold up the gui. Follow from there
+		if len(x):
+			self.append(x, y)
+		self.timer.start(FOLLOW_INTERVAL)
+		self.poll()
+
+	def poll(self):
+		if not self.timer.isActive():
+			return
+
+		try:
+			size = os.stat(self.filename).st_size
+		except OSError:
+			return
+
+		# some writers replace the file, which drops it from the watcher
+		if self.filename not in self.watcher.files():
+			self.watcher.addPath(self.filename)
+
+		if size < self.offset:
+			# truncated or replaced by a shorter file, start over
+			self.reset()
+			self.restarted.emit()
+
+		if size == self.offset:
+			return
+
+		# this runs from the event loop, so an exception here would take the
+		# app down. The block is skipped and following carries on
+		try:
+			x, y = self.read(size)
+		except (OSError, ValueError, IndexError, UnicodeDecodeError) as e:
+			self.failed.emit('%s: %s' % (self.filename, e))
+			return
+
+		if len(x):
+			self.append(x, y)
+
+	def read(self, size):
+		# parses the complete lines between self.offset and size. The first
+		# read runs on the thread pool, so this only touches the read position
+		with open(self.filename, 'rb') as f:
+			f.seek(self.offset)
+			block = f.read(size - self.offset)
+		self.offset += len(block)
+
+		# keep a partly written last line until the rest of it arrives
+		block = self.remainder + block
+		end = block.rfind(b'\n') + 1
+		block, self.remainder = block[:end], block[end:]
+		if not block:
+			return np.empty(0), np.empty(0)
+
+		if self.delimiter is None:
+			delimiter = get_delimiter(self.filename)
+			self.delimiter = None if delimiter == ' ' else delimiter
+
+		return parse_2d_block(block, self.delimiter)
+
+	def append(self, x, y):
+		k = len(x)
+		if self.n + k > len(self.x):
+			capacity = max(2 * len(self.x), self.n + k)
+			self.x = np.concatenate([self.x[:self.n], np.empty(capacity - self.n)])
+			self.y = np.concatenate([self.y[:self.n], np.empty(capacity - self.n)])
+
+		self.x[self.n:self.n + k] = x
+		self.y[self.n:self.n + k] = y
+		self.n += k
+
+		self.appended.emit(self.x[:self.n], self.y[:self.n], k)
+
+
+class DataCache():
+	# parsed x/y arrays of files opened before, saved as .npy files that are
+	# memory mapped when the file is opened again. Entries are looked up by
+	# path and only used while the file's size and mtime are unchanged.
+	# Loaders run on several threads at once, so the index is locked
+
+	def __init__(self, cache_dir=CACHE_DIR, limit=CACHE_LIMIT):
+		self.cache_dir = cache_dir
+		self.limit = limit
+		self.index_file = os.path.join(cache_dir, 'index.json')
+		self.lock = threading.Lock()
+		os.makedirs(cache_dir, exist_ok=True)
+
+		try:
+			with open(self.index_file) as f:
+				self.entries = json.load(f)['entries']
+		except (FileNotFoundError, json.JSONDecodeError, KeyError):
+			self.entries = {}
+
+	def data_file(self, path):
+		return os.path.join(self.cache_dir, hashlib.sha1(path.encode()).hexdigest() + '.npy')
+
+	def load(self, filename, stat):
+		path = os.path.abspath(filename)
+		with self.lock:
+			entry = self.entries.get(path)
+			if entry is None or entry['key'] != [stat.st_size, stat.st_mtime_ns]:
+				return None
+
+		try:
+			data = np.load(self.data_file(path), mmap_mode='r')
+		except (OSError, ValueError):
+			return None
+
+		with self.lock:
+			entry['used'] = time.time()
+			self.save()
+
+		return data[0], data[1]
+
+	def store(self, filename, stat, x, y):
+		path = os.path.abspath(filename)
+		data_file = self.data_file(path)
+
+		# write under a temporary name so a half written file is never loaded
+		tmp = '%s.%d.tmp' % (data_file, threading.get_ident())
+		with open(tmp, 'wb') as f:
+			np.save(f, np.vstack([x, y]))
+		os.replace(tmp, data_file)
+
+		with self.lock:
+			self.entries[path] = {'key': [stat.st_size, stat.st_mtime_ns],
+				'bytes': os.path.getsize(data_file), 'used': time.time()}
+			self.evict()
+			self.save()
+
+	def evict(self):
+		total = sum(entry['bytes'] for entry in self.entries.values())
+		for path, entry in sorted(self.entries.items(), key=lambda item : item[1]['used']):
+			if total <= self.limit:
+				break
+
+			try:
+				os.remove(self.data_file(path))
+			except OSError:
+				pass
+			del self.entries[path]
+			total -= entry['bytes']
+
+	def save(self):
+		tmp = '%s.%d.tmp' % (self.index_file, threading.get_ident())
+		with open(tmp, 'w') as f:
+			json.dump({'entries': self.entries}, f)
+		os.replace(tmp, self.index_file)
+
+class LoaderSignals(QObject):
+	loaded = pyqtSignal(int, int, object, object)
+	failed = pyqtSignal(int, int, str)
+
+class FileLoader(QRunnable):
+	# parses one file on the thread pool and hands the arrays back to the gui thread.
+	# A followed file is read by its FileFollower up to its current size
+
+	def __init__(self, batch, index, filename, cache=None, follower=None):
+		super().__init__()
+		self.batch = batch
+		self.index = index
+		self.filename = filename
+		self.cache = cache
+		self.follower = follower
+		self.signals = LoaderSignals()
+
+	def run(self):
+		try:
+			stat = os.stat(self.filename)
+			data = None
+			if self.follower is not None:
+				data = self.follower.read(stat.st_size)
+			elif self.cache and stat.st_size >= CACHE_MIN_SIZE:
+				data = self.cache.load(self.filename, stat)
+
+			if data is None:
+				data = read_2d_file(self.filename)
+				if self.cache and stat.st_size >= CACHE_MIN_SIZE:
+					try:
+						self.cache.store(self.filename, stat, *data)
+					except OSError:
+						pass
+
+			x, y = data
+		except (OSError, ValueError, IndexError, UnicodeDecodeError) as e:
+			self.signals.failed.emit(self.batch, self.index, '%s: %s' % (self.filename, e))
+		else:
+			self.signals.loaded.emit(self.batch, self.index, x, y)
+
+
 class App(QMainWindow):
 
 	def __init__(self):
@@ -86,6 +466,10 @@ class App(QMainWindow):
 		self.plotCanvas = PlotCanvas(self, width=5, height=4)
 		self.plotCanvas.move(0,0)
 
+		self.toolbar = NavigationToolbar(self.plotCanvas, self)
+		self.toolbar.move(0,400)
+		self.toolbar.resize(500,40)
+
 		newButton = QPushButton('New Plot', self)
 		newButton.setToolTip('Delete current plot and visualize new data')
 		newButton.clicked.connect(lambda : self.new_button_click())
@@ -112,6 +496,13 @@ class App(QMainWindow):
 		labelButton.move(500,150)
 		labelButton.resize(140,50)
 
+		self.followButton = QPushButton('Follow File', self)
+		self.followButton.setToolTip('Plot a file that is still being written and keep adding new lines')
+		self.followButton.clicked.connect(lambda : self.follow_button_click())
+		self.followButton.move(500,200)
+		self.followButton.resize(140,50)
+		self.follower = None
+
 
 		styleBox = QComboBox(self)
 		styleBox.addItems(['Dots', 'Line', 'Connected Dots'])
@@ -119,15 +510,29 @@ class App(QMainWindow):
 		styleBox.move(500, 300)
 		styleBox.resize(140, 50)
 
+		self.loadingBar = QProgressBar(self)
+		self.loadingBar.setFormat('Loading %v/%m')
+		self.loadingBar.move(500, 250)
+		self.loadingBar.resize(140, 30)
+		self.loadingBar.hide()
+
+		self.threadPool = QThreadPool.globalInstance()
+		self.batch = 0
+
+		try:
+			self.cache = DataCache()
+		except OSError:
+			self.cache = None
+
 		self.show()
 		return
 
 	def open_file_dialog(self):
 		options = QFileDialog.Options()
 		options |= QFileDialog.DontUseNativeDialog
-		filename, _ = QFileDialog.getOpenFileName(self,"QFileDialog.getOpenFileName()", "","All Files (*);;CSV Files (*.csv);;Text files (*.txt)", options=options)
-		if filename:
-			return filename
+		filenames, _ = QFileDialog.getOpenFileNames(self,"QFileDialog.getOpenFileNames()", "","All Files (*);;CSV Files (*.csv);;Text files (*.txt)", options=options)
+		if filenames:
+			return filenames
 		else:
 			return None
 
@@ -143,23 +548,121 @@ class App(QMainWindow):
 
 
 	def new_button_click(self):
-		filename = self.open_file_dialog()
-		if filename:
-			x, y = read_2d_file(filename)
-
-			self.plotCanvas.new_data(x, y)
+		filenames = self.open_file_dialog()
+		if filenames:
+			self.stop_following()
+			self.load_files(filenames, replace=True)
 		else:
 			return
 
 	def add_button_click(self):
-		filename = self.open_file_dialog()
-		if filename:
-			x, y = read_2d_file(filename)
+		filenames = self.open_file_dialog()
+		if filenames:
+			self.load_files(filenames, replace=False)
+		else:
+			return
 
-			self.plotCanvas.add_data(x, y)
+	def load_files(self, filenames, replace):
+		# files of earlier selections still loading are dropped when they finish
+		self.batch += 1
+		self.replace = replace
+		self.loaded = {}
+		self.nextIndex = 0
+		self.nDone = 0
+		self.nFiles = len(filenames)
+
+		self.loadingBar.setRange(0, self.nFiles)
+		self.loadingBar.setValue(0)
+		self.loadingBar.show()
+
+		for i, filename in enumerate(filenames):
+			loader = FileLoader(self.batch, i, filename, self.cache)
+			loader.signals.loaded.connect(self.file_loaded)
+			loader.signals.failed.connect(self.file_failed)
+			self.threadPool.start(loader)
+
+	def file_loaded(self, batch, index, x, y):
+		if batch == self.batch:
+			self.loaded[index] = (x, y)
+			self.show_loaded()
+
+	def file_failed(self, batch, index, message):
+		if batch == self.batch:
+			self.loaded[index] = None
+			self.show_loaded()
+			QMessageBox.warning(self, 'Qt Plot', 'Could not read %s' % message)
+
+	def show_loaded(self):
+		self.nDone += 1
+		self.loadingBar.setValue(self.nDone)
+
+		# files finish in any order but are plotted in the order they were selected
+		while self.nextIndex in self.loaded:
+			data = self.loaded.pop(self.nextIndex)
+			self.nextIndex += 1
+			if data is None:
+				continue
+
+			if self.replace:
+				self.plotCanvas.new_data(*data)
+				self.replace = False
+			else:
+				self.plotCanvas.add_data(*data)
+
+		if self.nextIndex == self.nFiles:
+			self.loadingBar.hide()
+
+	def follow_button_click(self):
+		if self.follower:
+			self.stop_following()
+			return
+
+		filenames = self.open_file_dialog()
+		if filenames:
+			# the followed file replaces the plot, like New Plot
+			self.batch += 1
+			self.plotCanvas.new_data([], [])
+			self.followIndex = len(self.plotCanvas.xData) - 1
+
+			self.follower = FileFollower(filenames[0], self)
+			self.follower.appended.connect(
+				lambda x, y, k : self.plotCanvas.extend_data(self.followIndex, x, y, k))
+			self.follower.restarted.connect(
+				lambda : self.plotCanvas.extend_data(self.followIndex, np.empty(0), np.empty(0), 0))
+			self.follower.failed.connect(
+				lambda message : self.statusBar().showMessage('Skipped lines of %s' % message, 10000))
+
+			# what's already in the file loads like any other file
+			self.loadingBar.setRange(0, 0)
+			self.loadingBar.show()
+			loader = FileLoader(self.batch, 0, filenames[0], follower=self.follower)
+			loader.signals.loaded.connect(self.follow_loaded)
+			loader.signals.failed.connect(self.follow_failed)
+			self.threadPool.start(loader)
+
+			self.followButton.setText('Stop Following')
 		else:
 			return
 
+	def follow_loaded(self, batch, index, x, y):
+		if batch == self.batch and self.follower:
+			self.loadingBar.hide()
+			self.follower.start(x, y)
+
+	def follow_failed(self, batch, index, message):
+		if batch == self.batch and self.follower:
+			self.loadingBar.hide()
+			self.stop_following()
+			QMessageBox.warning(self, 'Qt Plot', 'Could not read %s' % message)
+
+	def stop_following(self):
+		if self.follower:
+			self.loadingBar.hide()
+			self.follower.stop()
+			self.follower.deleteLater()
+			self.follower = None
+			self.followButton.setText('Follow File')
+
 	def save_button_click(self):
 		filename = self.save_file_dialog()
 		if filename:
@@ -200,6 +703,9 @@ class PlotCanvas(FigureCanvas):
 
 		self.xData = []
 		self.yData = []
+		self.xSorted = []
+		self.views = []
+		self.lines = []
 
 		self.setup_new_figure()
 		self.plot_onOpen()
@@ -209,7 +715,11 @@ class PlotCanvas(FigureCanvas):
 		self.ylabel = ylabel
 		self.title = title
 
-		self.plot()
+		ax = self.axes
+		ax.set_title(self.title)
+		ax.set_xlabel(self.xlabel)
+		ax.set_ylabel(self.ylabel)
+		self.draw_idle()
 
 	def set_style(self, newStyle):
 		['Dots', 'Line', 'Connected Dots']
@@ -222,10 +732,22 @@ class PlotCanvas(FigureCanvas):
 
 		if self.plotStyle != styleText:
 			self.plotStyle = styleText
-			self.plot()
+
+			linestyle, marker = LINE_STYLES[styleText]
+			for line in self.lines:
+				line.set_linestyle(linestyle)
+				line.set_marker(marker)
+
+			# lines and markers are decimated differently
+			self.redecimate(self.axes)
 
 	def save_figure(self, filename):
+		# vector formats can be zoomed after saving, so save every point
+		for i, line in enumerate(self.lines):
+			line.set_data(self.xData[i], self.yData[i])
+
 		self.figure.savefig(filename)
+		self.redecimate(self.axes)
 
 
 	def setup_new_figure(self):
@@ -244,34 +766,197 @@ class PlotCanvas(FigureCanvas):
 	def new_data(self, x, y):
 		self.xData = []
 		self.yData = []
+		self.xSorted = []
+		self.views = []
+
+		for line in self.lines:
+			line.remove()
+		self.lines = []
+
+		# forget the old data's limits and start the colour cycle over
+		self.axes.relim()
+		self.axes.set_prop_cycle(None)
 
 		self.add_data(x, y)
 
 
 	def add_data(self, x, y):
+		x = np.asarray(x, dtype=float)
+		y = np.asarray(y, dtype=float)
+
 		self.xData.append(x)
 		self.yData.append(y)
+		self.xSorted.append(bool(np.all(x[1:] >= x[:-1])))
+		self.views.append({})
+
+		if self.showingDino:
+			self.plot()
+			return
+
+		line, = self.axes.plot(*self.decimated(len(self.xData) - 1), self.plotStyle)
+		self.lines.append(line)
+		self.include_data(len(self.xData) - 1)
+
+		self.axes.autoscale()
+		self.draw_idle()
 
-		self.plot()
+
+	def extend_data(self, i, x, y, k):
+		# x and y are all of dataset i, the last k points are new
+		new = x[len(x) - k:]
+		before = x[len(x) - k - 1:len(x) - k]
+		self.xSorted[i] = (self.xSorted[i] or k == len(x)) and bool(
+			np.all(new[1:] >= new[:-1]) and np.all(before <= new[:1]))
+
+		self.xData[i] = x
+		self.yData[i] = y
+
+		ax = self.axes
+		if k == len(x):
+			# first points or a restarted file, so the limits are rebuilt from
+			# the other datasets' extents without the old points
+			self.views[i] = {}
+			ax.ignore_existing_data_limits = True
+			for j in range(len(self.xData)):
+				if j != i:
+					self.include_data(j)
+			ax.update_datalim(np.column_stack([new, y[len(y) - k:]]))
+		elif k:
+			self.grow_datalim(new, y[len(y) - k:])
+		ax.autoscale_view()
+
+		self.lines[i].set_data(*self.decimated(i, ax.get_xlim(), ax.get_ylim()))
+		self.draw_idle()
+
+
+	def include_data(self, i):
+		# the lines only hold decimated points, so the data limits are taken
+		# from the full dataset, or autoscaling could miss its extremes
+		x, y = self.xData[i], self.yData[i]
+		if len(x):
+			self.axes.update_datalim([(np.nanmin(x), np.nanmin(y)), (np.nanmax(x), np.nanmax(y))])
+
+
+	def grow_datalim(self, x, y):
+		# points outside the data limits push them out by half their span
+		# again, so while following a growing file the view only moves, and
+		# everything has to be decimated again, a logarithmic number of times
+		x0, x1 = np.nanmin(x), np.nanmax(x)
+		y0, y1 = np.nanmin(y), np.nanmax(y)
+
+		if not self.axes.ignore_existing_data_limits:
+			(xmin, ymin), (xmax, ymax) = self.axes.dataLim.get_points()
+			if x0 < xmin:
+				x0 -= (xmax - x0) / 2
+			if x1 > xmax:
+				x1 += (x1 - xmin) / 2
+			if y0 < ymin:
+				y0 -= (ymax - y0) / 2
+			if y1 > ymax:
+				y1 += (y1 - ymin) / 2
+
+		self.axes.update_datalim([(x0, y0), (x1, y1)])
+
+
+	def decimated(self, i, xlim=None, ylim=None):
+		x, y = self.xData[i], self.yData[i]
+		if len(x) == 0:
+			return x, y
+
+		# before the first draw the view is the extent of the data
+		if xlim is None:
+			xlim = (np.nanmin(x), np.nanmax(x))
+			ylim = (np.nanmin(y), np.nanmax(y))
+		if xlim[0] > xlim[1]:
+			xlim = xlim[::-1]
+		if ylim[0] > ylim[1]:
+			ylim = ylim[::-1]
+		if xlim[0] == xlim[1] or ylim[0] == ylim[1]:
+			return x, y
+
+		bbox = self.axes.bbox
+		width = max(int(bbox.width), 1)
+		height = max(int(bbox.height), 1)
+		# sorted data keeps the points of its line (M4), anything else a point
+		# per pixel and, for lines, the points either side of the view's edges
+		if self.plotStyle == 'o':
+			method = 'points'
+		elif not self.xSorted[i]:
+			method = 'path'
+		else:
+			method = 'line' if self.plotStyle == '-' else 'marked line'
+
+		# the last result of each method is kept, so switching styles back
+		# and forth without moving the view does not decimate again. Points
+		# appended to a followed file since then are decimated together with
+		# that result, which gives the same points as decimating everything
+		n = len(x)
+		view = (tuple(xlim), tuple(ylim), width, height)
+		cached = self.views[i].get(method)
+		if cached is not None and cached[0] == view:
+			if cached[1] == n:
+				return cached[2]
+			x = np.concatenate([cached[2][0], x[cached[1]:]])
+			y = np.concatenate([cached[2][1], y[cached[1]:]])
+
+		# markers are placed with sub-pixel precision, so keep a point per half
+		# pixel, and keep markers that reach into the view from outside
+		radius = plt.rcParams['lines.markersize'] * self.figure.dpi / 72 / 2
+		pad = int(np.ceil(2 * radius)) + 1
+
+		if method in ['line', 'marked line']:
+			data = decimate_line(x, y, xlim, width)
+		else:
+			data = decimate_points(x, y, xlim, ylim, 2 * width, 2 * height,
+				pad=pad, connected=method == 'path')
+
+		if method == 'marked line':
+			# the markers of a point per half pixel, in order along the line
+			markers = decimate_points(x, y, xlim, ylim, 2 * width, 2 * height, pad=pad)
+			mx, my = np.concatenate([data[0], markers[0]]), np.concatenate([data[1], markers[1]])
+			order = np.argsort(mx, kind='stable')
+			data = mx[order], my[order]
+
+		self.views[i][method] = (view, n, data)
+		return data
+
+
+	def redecimate(self, ax):
+		xlim, ylim = ax.get_xlim(), ax.get_ylim()
+		for i, line in enumerate(self.lines):
+			line.set_data(*self.decimated(i, xlim, ylim))
+
+		self.draw_idle()
 
 
 	def plot_onOpen(self):
 		ax = self.axes
 		ax.plot(dinoX, dinoY, 'ko')
 		ax.set_title('Datasaurus wishes you happy plotting!')
+		self.showingDino = True
 
 
 	def plot(self):
+		# full rebuild, only needed to replace the welcome plot. Everything
+		# else updates the existing lines in place
 		self.axes.clear()
+		self.showingDino = False
 		ax = self.axes
+		self.lines = []
 		for i in range(len(self.xData)):
-			ax.plot(self.xData[i], self.yData[i], self.plotStyle)
+			line, = ax.plot(*self.decimated(i), self.plotStyle)
+			self.lines.append(line)
+			self.include_data(i)
+
+		# clearing the axes drops their callbacks, so reconnect
+		ax.callbacks.connect('xlim_changed', self.redecimate)
+		ax.callbacks.connect('ylim_changed', self.redecimate)
 
 		ax.set_title(self.title)
 		ax.set_xlabel(self.xlabel)
 		ax.set_ylabel(self.ylabel)
 
-		self.draw()
+		self.draw_idle()
 
 # ---------- Main Program? -------------------------------------
 
@@ -1,10 +1,15 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from reportlab import rl_config
+from reportlab.pdfbase import pdfdoc
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import landscape, letter
+from reportlab.lib.utils import ImageReader
 from PIL import Image
 from datetime import datetime
-import glob, os
-
+import functools
+from io import BytesIO
+import glob, hashlib, json, os, tempfile, time, zlib
 
 
 def find_files(pattern):
@@ -16,69 +21,364 @@ def find_files(pattern):
 	return files
 
 
+def file_hash(file):
+	h = hashlib.sha1()
+	with open(file, 'rb') as f:
+		for chunk in iter(lambda : f.read(1 << 20), b''):
+			h.update(chunk)
 
-def make_deck(args):
+	return h.hexdigest()
 
-	page_width, page_height = landscape(letter)
-	c = canvas.Canvas(args.outfile, pagesize=landscape(letter))
 
+def fit_scale(im_size, box_size):
+	im_width, im_height = im_size
+	box_width, box_height = box_size
 
-	
+	if im_width > box_width or im_height > box_height:
+		return min(box_width / im_width, box_height / im_height) / 1.1
+	else:
+		return 1
 
-	n_pages = len(args.figures)
 
-	if args.title:
-		c.setFont('Helvetica', 36)
-		linespacing = 36 * 1.25
-		c.drawCentredString(page_width//2, 3*page_height//5, args.title)
-		c.setFont('Helvetica', 20)
-		linespacing = 20 * 1.25
-		if args.author:
-			c.drawCentredString(page_width//2, 2*page_height//5, args.author)
-		c.drawCentredString(page_width//2, 20, datetime.now().strftime('%m/%d/%Y'))
-		c.showPage()
+def prepare_figure(file, outfile, box_size, dpi, encoding, quality):
+	'''
+	Decodes a figure, downsamples it to the resolution it will be shown at
+	when fit in box_size, and encodes it to outfile as a ready pdf image
+	stream: a jpeg file, or the raw pixels deflated. Runs in a worker process.
 
-	if args.reverse:
-		args.figures.reverse()
+	Returns the width and height of the figure in the box in points, and the
+	pixel width, height and pdf color space of the stream.
+	'''
+	with Image.open(file) as fig:
+		im_width, im_height = fig.size
+		scale = fit_scale(fig.size, box_size)
+		width = im_width*scale//1
+		height = im_height*scale//1
 
-	for i, file in enumerate(args.figures):
+		# pixels needed to show the figure at dpi, never upsample
+		px_width = min(im_width, max(1, round(width / 72 * dpi)))
+		px_height = min(im_height, max(1, round(height / 72 * dpi)))
 
-		if i+1 < n_pages:
-			print(f'Working on page {i+1}/{n_pages}', end='\r')
-		else:
-			print(f'Working on page {i+1}/{n_pages}')
-		fig = Image.open(file)
+		if fig.format == 'JPEG':
+			fig.draft('RGB', (px_width, px_height))
 
-		im_width, im_height = fig.size
+		if fig.mode in ('RGBA', 'LA', 'P'):
+			fig = fig.convert('RGBA')
+			background = Image.new('RGBA', fig.size, 'white')
+			fig = Image.alpha_composite(background, fig)
+
+		if fig.mode not in ('RGB', 'L'):
+			fig = fig.convert('RGB')
 
-		if im_width > page_width:
-			scale = page_width / im_width / 1.1
+		if (px_width, px_height) != fig.size:
+			fig = fig.resize((px_width, px_height), resample=Image.Resampling.LANCZOS)
 
-		elif im_height > page_height:
-			scale = page_height / im_height / 1.1
+		# write under a temporary name so an interrupted build never leaves a partial payload
+		tmp = outfile + '.tmp'
+		if encoding == 'jpeg':
+			fig.save(tmp, format='JPEG', quality=quality, optimize=True)
 		else:
-			scale = 1
+			with open(tmp, 'wb') as f:
+				f.write(zlib.compress(fig.tobytes()))
+		os.replace(tmp, outfile)
+
+		color_space = 'DeviceGray' if fig.mode == 'L' else 'DeviceRGB'
+
+	return (width, height), (px_width, px_height, color_space)
+
+
+def register_payload(c, path, image, stream):
+	'''
+	Registers an encoded image stream as the image XObject that
+	c.drawImage(path) looks up, so reportlab uses the stream as is instead of
+	decoding the file and compressing it again. This relies on reportlab
+	internals, so it is only used once embedding_works has checked them.
+	'''
+	from reportlab.lib.utils import _digester
+
+	name = _digester(f'{path}None'.encode('utf-8')) # drawImage's name for (path, mask=None)
+	reg_name = c._doc.getXObjectName(name)
+	if c._doc.idToObject.get(reg_name) is not None:
+		return
+
+	img = pdfdoc.PDFImageXObject(name)
+	img.width, img.height, img.colorSpace = image
+	img.bitsPerComponent = 8
+	img._filters = ('DCTDecode',) if path.endswith('.jpg') else ('FlateDecode',)
+	img.streamContent = stream
+
+	c._setXObjects(img)
+	c._doc.Reference(img, reg_name)
+	c._doc.addForm(name, img)
+
+
+@functools.cache
+def embedding_works():
+	'''
+	Checks on a scratch canvas that drawImage picks up a registered payload
+	instead of opening the file, which does not exist here.
+	'''
+	path = os.path.join(tempfile.gettempdir(), 'quickdeck-feature-test.flate')
+	try:
+		c = canvas.Canvas(BytesIO())
+		register_payload(c, path, (1, 1, 'DeviceGray'), zlib.compress(b'\0'))
+		n_objects = len(c._doc.idToObject)
+		c.drawImage(path, 0, 0, width=1, height=1)
+		return len(c._doc.idToObject) == n_objects
+	except Exception:
+		return False
+
+
+def embed_payload(c, path, image):
+	'''
+	Returns what to pass to c.drawImage for a payload from prepare_figure.
+
+	The payload is registered with the canvas where the reportlab internals
+	allow it. Otherwise jpeg payloads are drawn from the file, and flate
+	payloads are decoded for reportlab to compress again.
+	'''
+	if embedding_works():
+		with open(path, 'rb') as f:
+			register_payload(c, path, image, f.read())
+		return path
+
+	if path.endswith('.jpg'):
+		return path
+
+	width, height, color_space = image
+	with open(path, 'rb') as f:
+		data = zlib.decompress(f.read())
+	mode = 'L' if color_space == 'DeviceGray' else 'RGB'
+	return ImageReader(Image.frombytes(mode, (width, height), data))
+
+
+class RenderCache():
+	'''
+	Scaled and encoded figures from previous builds, so a rebuild only
+	re-processes figures that changed.
+
+	Source files are looked up by path, size and mtime to find their content
+	hash without reading them. Encoded payloads are image files named by the
+	content hash and the encoding settings, so a touched but unchanged figure
+	or a copy of one still hits the cache.
+	'''
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		self.index_file = os.path.join(cache_dir, 'index.json')
+		os.makedirs(cache_dir, exist_ok=True)
+
+		try:
+			with open(self.index_file) as f:
+				index = json.load(f)
+			self.files = index['files']
+			self.payloads = index['payloads']
+		except (FileNotFoundError, json.JSONDecodeError, KeyError):
+			self.files = {}
+			self.payloads = {}
+
+	def source_hash(self, file):
+		path = os.path.abspath(file)
+		stat = os.stat(file)
+		key = [stat.st_size, stat.st_mtime_ns]
+
+		entry = self.files.get(path)
+		if entry is not None and entry[:2] == key:
+			return entry[2]
+
+		h = file_hash(file)
+		self.files[path] = key + [h]
+		return h
+
+	def payload(self, h, box_size, dpi, encoding, quality):
+		settings = f'{h}-{box_size[0]}x{box_size[1]}-{dpi}-{encoding}-{quality}'
+		key = hashlib.sha1(settings.encode()).hexdigest()
+		ext = '.jpg' if encoding == 'jpeg' else '.flate'
+
+		return key, os.path.join(self.cache_dir, key + ext)
+
+	def get(self, key, path):
+		entry = self.payloads.get(key)
+		if entry is None or 'image' not in entry or not os.path.exists(path):
+			return None
+
+		return tuple(entry['size']), tuple(entry['image'])
+
+	def put(self, key, h, size, image):
+		self.payloads[key] = {'hash': h, 'size': size, 'image': image}
+
+	def save(self):
+		# drop payloads for figures and figure versions that no longer exist
+		for path in list(self.files):
+			if not os.path.exists(path):
+				del self.files[path]
+
+		current = set(entry[2] for entry in self.files.values())
+		for key, entry in list(self.payloads.items()):
+			stale = ['.png'] # payloads from before streams were cached ready to embed
+			if entry['hash'] not in current:
+				del self.payloads[key]
+				stale += ['.jpg', '.flate']
+
+			for ext in stale:
+				path = os.path.join(self.cache_dir, key + ext)
+				if os.path.exists(path):
+					os.remove(path)
+
+		tmp = self.index_file + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump({'files': self.files, 'payloads': self.payloads}, f)
+		os.replace(tmp, self.index_file)
 
-		# fig = fig.resize(( int(im_width * scale), int(im_height*scale) ), resample=Image.Resampling.LANCZOS)
-		# im_width, im_height = fig.size
 
-		left = page_width//2 - im_width*scale//2
-		bottom = page_height//2 - im_height*scale//2
-		width = im_width*scale//1
-		height = im_height*scale//1
+def make_deck(args):
+	# image and page streams are written into the pdf as binary, so cached
+	# payloads are copied in unchanged instead of being ascii85 encoded.
+	# useA85 is global to reportlab, so it is only changed for this deck
+	use_a85 = rl_config.useA85
+	rl_config.useA85 = 0
+	try:
+		build_deck(args)
+	finally:
+		rl_config.useA85 = use_a85
+
+
+def build_deck(args):
+
+	page_width, page_height = landscape(letter)
+	c = canvas.Canvas(args.outfile, pagesize=landscape(letter))
+
+	page_size = (page_width, page_height)
+	logo_size = (page_width/4, 72)
 
-		c.drawInlineImage(fig, left, bottom, width=width, height=height)
+	if args.reverse:
+		args.figures.reverse()
 
-		if args.fignames:
-			c.setFont('Helvetica', 24)
-			linespacing = 24 * 1.25
-			fig_name = '.'.join(file.split('.')[:-1])
-			c.drawCentredString(page_width//2, bottom+height+4, fig_name)
+	n_pages = len(args.figures)
 
-		c.showPage()
+	if args.no_cache:
+		tmp_dir = tempfile.TemporaryDirectory()
+		cache = RenderCache(tmp_dir.name)
+	else:
+		cache = RenderCache(os.path.expanduser(args.cache_dir))
+
+	with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+
+		# payloads are keyed by content hash, so identical figures are only
+		# encoded once, and reportlab embeds each payload file once as an XObject
+		work = {}
+		def request(file, box_size):
+			h = cache.source_hash(file)
+			key, path = cache.payload(h, box_size, args.dpi, args.encoding, args.quality)
+
+			if key not in work:
+				work[key] = {'hash': h, 'path': path, 'info': cache.get(key, path),
+					'file': file, 'box_size': box_size, 'future': None, 'source': None}
+
+			return key
+
+		def submit(key):
+			job = work[key]
+			if job['info'] is None and job['future'] is None:
+				job['future'] = pool.submit(prepare_figure, job['file'], job['path'],
+					job['box_size'], args.dpi, args.encoding, args.quality)
+
+		def result(key):
+			submit(key)
+			job = work[key]
+			if job['info'] is None:
+				size, image = job['future'].result()
+				job['info'] = tuple(size), tuple(image)
+				job['future'] = None
+				cache.put(key, job['hash'], size, image)
+
+			size, image = job['info']
+			if job['source'] is None:
+				job['source'] = embed_payload(c, job['path'], image)
+			return job['source'], size
+
+		keys = [request(file, page_size) for file in args.figures]
+		if args.logo:
+			logo_key = request(args.logo, logo_size)
+			submit(logo_key)
+
+		n_cached = sum(job['info'] is not None for job in work.values())
+		print(f'{n_cached}/{len(work)} images cached')
+
+		# changed figures are decoded, scaled and encoded in parallel, but only
+		# a few pages ahead of the page being laid out, so at most that many
+		# figures are ever decoded at once however long the deck is
+		prefetch = args.prefetch or 2 * (args.jobs or os.cpu_count() or 1)
+		timings = []
+
+		for ahead in keys[:prefetch]:
+			submit(ahead)
+
+		if args.title:
+			if args.logo:
+				logo_path, (logo_width, logo_height) = result(logo_key)
+				c.drawImage(logo_path, page_width//2 - logo_width//2,
+					page_height - logo_height - 36, width=logo_width, height=logo_height)
+
+			c.setFont('Helvetica', 36)
+			linespacing = 36 * 1.25
+			c.drawCentredString(page_width//2, 3*page_height//5, args.title)
+			c.setFont('Helvetica', 20)
+			linespacing = 20 * 1.25
+			if args.author:
+				c.drawCentredString(page_width//2, 2*page_height//5, args.author)
+			c.drawCentredString(page_width//2, 20, datetime.now().strftime('%m/%d/%Y'))
+			c.showPage()
+
+		for i, (file, key) in enumerate(zip(args.figures, keys)):
+
+			if not args.timing:
+				if i+1 < n_pages:
+					print(f'Working on page {i+1}/{n_pages}', end='\r')
+				else:
+					print(f'Working on page {i+1}/{n_pages}')
+
+			for ahead in keys[i:i+prefetch]:
+				submit(ahead)
+
+			start = time.perf_counter()
+			source, (width, height) = result(key)
+			waited = time.perf_counter() - start
+			left = page_width//2 - width//2
+			bottom = page_height//2 - height//2
+
+			# the payload stream is copied into the pdf as is where possible
+			c.drawImage(source, left, bottom, width=width, height=height)
+
+			if args.logo:
+				# same image as the title slide logo, drawn smaller in the corner
+				logo_path, (logo_width, logo_height) = result(logo_key)
+				c.drawImage(logo_path, page_width - logo_width//2 - 8, 8,
+					width=logo_width//2, height=logo_height//2)
+
+			if args.fignames:
+				c.setFont('Helvetica', 24)
+				linespacing = 24 * 1.25
+				fig_name = '.'.join(file.split('.')[:-1])
+				c.drawCentredString(page_width//2, bottom+height+4, fig_name)
+
+			c.showPage()
+
+			if args.timing:
+				drawn = time.perf_counter() - start - waited
+				timings.append((waited + drawn, i+1, file))
+				print(f'page {i+1}/{n_pages}: {waited:.3f} s waiting for image, {drawn:.3f} s drawing  {file}')
+
+	if timings:
+		print(f'{sum(t for t, _, _ in timings):.2f} s on figure pages, slowest:')
+		for t, page, file in sorted(timings, reverse=True)[:5]:
+			print(f'  page {page}: {t:.3f} s  {file}')
 
 	print('Saving...')
 	c.save()
+	if args.no_cache:
+		tmp_dir.cleanup()
+	else:
+		cache.save()
 	print('Done!')
 
 
@@ -101,6 +401,17 @@ if __name__ == '__main__':
 	parser.add_argument('--title', help='title for title slide')
 	parser.add_argument('--author', help='author name')
 	parser.add_argument('--fignames', action='store_true', help='include figure file names on slide')
+	parser.add_argument('--logo', help='image to put on the title slide and in the corner of every slide')
+
+	# image quality
+	parser.add_argument('--dpi', type=int, default=150, help='resolution figures are downsampled to on the page')
+	parser.add_argument('--encoding', choices=['flate', 'jpeg'], default='flate', help='flate is lossless, jpeg is much smaller for photos and micrographs')
+	parser.add_argument('--quality', type=int, default=85, help='jpeg quality, 1-95')
+	parser.add_argument('--cache_dir', default='~/.cache/quickdeck', help='where encoded figures are kept between builds')
+	parser.add_argument('--no_cache', action='store_true', help='encode every figure and don\'t keep them')
+	parser.add_argument('-j', '--jobs', type=int, help='number of worker processes. Defaults to number of cpus')
+	parser.add_argument('--prefetch', type=int, help='number of pages ahead to prepare figures. Defaults to twice the number of workers')
+	parser.add_argument('--timing', action='store_true', help='report time spent on each page')
 
 	# parser.add_argument('--scaling', choices=['fit', 'fill', ''])
 
@@ -117,4 +428,4 @@ if __name__ == '__main__':
 
 
 
-	make_deck(args)
\ No newline at end of file
+	make_deck(args)
@@ -5,6 +5,18 @@ Function for quick visualization of 2D data, ignores headers,
 automatically handles comma, space, and tab delimiters, 
 other delimiters can be specified if those listed above are not found.
 
+Parsed data is cached in ~/.cache/quickplot, so replotting the same
+files with different styling skips parsing them. The least recently
+used entries are removed when the cache passes --cache_size.
+
+Options that take an expression (--x_lambda, --wherex, --equation, ...)
+are checked once before anything is read and evaluated on whole numpy
+arrays. They can use their variables and common numpy functions only.
+and/or/not and chained comparisons work element by element.
+
+Files are read and preprocessed on a pool of worker threads (or
+processes with --processes) while earlier files are being plotted.
+
 Usage: argv-based, pass as many filenames as you want 
 as command line arguments
 
@@ -13,12 +25,19 @@ as command line arguments
 '''
 
 import argparse
+import ast
+import builtins
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
 import glob
+import hashlib
 import numpy as np
 import os
+import threading
 import pandas as pd
 from scipy import sparse
-from scipy.sparse.linalg import spsolve
+from scipy.linalg import solveh_banded
 import string
 import sys
 
@@ -28,6 +47,11 @@ import matplotlib
 
 
 
+# bytes read from the start of a file to find its delimiter and header, and
+# the most read looking for the end of a long header
+SAMPLE_SIZE = 1 << 16
+SAMPLE_LIMIT = 1 << 22
+
 # ---------- Helper functions ----------------------------------
 
 def find_files(pattern):
@@ -38,16 +62,43 @@ def find_files(pattern):
 
 	return files
 
-def read_2d_file(filename, columns):
-	x_col, y_col = columns
-
-	x, y = [], []
-	delimiter = find_delimiter(filename)
+class DelimiterNotFound(Exception):
+	# raised instead of asking for a delimiter, since files are read in
+	# workers that can't prompt. The main thread asks and reads the file again
+	def __init__(self, filename, sample):
+		super().__init__(filename, sample)
+		self.filename = filename
+		self.sample = sample
 
-	with open(filename) as f:
-		line = f.readline()
+def read_2d_file(filename, columns, delimiter=None):
+	x_col, y_col = columns
 
-		num_cols = len( line.split(delimiter) )
+	with open(filename, 'rb') as f:
+		# sniff the delimiter and header from the start of the file, then
+		# parse from the same handle with pandas' C parser
+		sample = f.read(SAMPLE_SIZE)
+		if delimiter is not None:
+			found = split_sample(sample, delimiter)
+		else:
+			found = find_delimiter(sample, columns)
+		# a header longer than the sample has no numbers in it yet, so read on
+		# until it ends. The sample doubles each time, so it's scanned in
+		# linear time. If there are numbers, just not in the requested
+		# columns, reading more won't help
+		while found is None and len(sample) < SAMPLE_LIMIT and find_delimiter(sample, [0]) is None:
+			more = f.read(len(sample))
+			if not more:
+				break
+			sample += more
+			found = find_delimiter(sample, columns)
+
+		# no rows have numbers in the requested columns, so find the number of
+		# columns for the checks below
+		if found is None:
+			found = find_delimiter(sample, [0])
+		if found is None:
+			raise DelimiterNotFound(filename, sample[:SAMPLE_SIZE])
+		delimiter, skip, num_cols = found
 
 		assert x_col < num_cols, \
 		'specified x column index {x} greater than number of columns in data file {file}'.format(x=x_col, file=filename)
@@ -55,42 +106,134 @@ def read_2d_file(filename, columns):
 		assert y_col < num_cols, \
 		'specified y column index {y} greater than number of columns in data file {file}'.format(y=y_col, file=filename)
 
-	with open(filename) as f:
-		for line in f:
-			lineSplit = line.split(delimiter)
+		sep = r'\s+' if delimiter == ' ' else delimiter
+		f.seek(0)
+		try:
+			data = pd.read_csv(f, sep=sep, header=None, skiprows=skip, usecols=[x_col, y_col],
+				dtype=float, engine='c')
+			if data.isna().to_numpy().any():
+				# empty, missing and NA fields come back as NaN too, drop those rows
+				f.seek(0)
+				text = pd.read_csv(f, sep=sep, header=None, skiprows=skip, usecols=[x_col, y_col],
+					dtype=str, engine='c', keep_default_na=False)
+				data = numeric_rows(data, text)
+		except ValueError:
+			# text further down the file, keep the rows where both columns are numbers
+			f.seek(0)
+			text = pd.read_csv(f, sep=sep, header=None, skiprows=skip, usecols=[x_col, y_col],
+				dtype=str, engine='c', on_bad_lines='skip', keep_default_na=False)
+			data = numeric_rows(text.apply(pd.to_numeric, errors='coerce'), text)
+
+	return data[x_col].to_numpy(dtype=float, copy=True), data[y_col].to_numpy(dtype=float, copy=True)
+
+def numeric_rows(data, text):
+	# the rows of parsed data where every field is a number. NaN only counts
+	# where the file says nan, matplotlib shows those as breaks in the line
+	written_nan = text.apply(lambda column : column.fillna('').astype(str)
+		.str.strip().str.lower().str.lstrip('+-') == 'nan')
+	return data[~(data.isna() & ~written_nan).any(axis=1)]
+
+def find_delimiter(sample, columns):
+	# the last line of the sample may be cut off
+	lines = sample.split(b'\n')
+	lines = lines[:-1] or lines
+
+	# pick the delimiter that splits the most lines into numbers in the
+	# requested columns, earlier delimiters win ties
+	best, best_count = None, 0
+	for delimiter in [',', ';', '\t', ' ']:
+		sep = None if delimiter == ' ' else delimiter.encode()
+		first, count = None, 0
+		for i, line in enumerate(lines):
+			lineSplit = line.split(sep)
+			if is_numeric_row(lineSplit, columns):
+				if first is None:
+					first = i
+					num_cols = len(lineSplit)
+				count += 1
+
+		if count > best_count:
+			best, best_count = (delimiter, first, num_cols), count
+
+	return best
+
+def ask_delimiter(filename, sample):
+	lines = sample.decode(errors='replace').split('\n')
 
-			if is_number(lineSplit[x_col]) and is_number(lineSplit[y_col]):
-				x.append( float( lineSplit[x_col] ))
-				y.append( float( lineSplit[y_col] ))
-			else:
-				continue
+	# if common delimiters are not found, prompt user for delimiter and check
+	delimiter = ''
+	while not delimiter or delimiter not in lines[0]:
+		delimiter = input('Please specify delimiter for %s:\n' % filename)
 
-	return x, y
+	return delimiter
 
-def find_delimiter(filename):
-	delimiters = [',', ';', '\t', ' ']
+def split_sample(sample, delimiter):
+	# header length and number of columns for a delimiter the user gave
+	lines = sample.decode(errors='replace').split('\n')
 
-	with open(filename) as f:
-		line = f.readline()
+	skip = 0
+	for line in lines:
+		if is_number(line.split(delimiter)[0]):
+			break
+		skip += 1
 
-	# try common delimiters, return if found
-	for delimiter in delimiters:
-		if try_delimiter(delimiter, line):
-			return delimiter
+	return delimiter, skip, len(lines[0].split(delimiter))
 
-	# if common delimiters are not found, prompt user for delimiter and check
-	while delimiter not in line:
-		delimiter = input('Please specify delimiter for %s:\n' % filename)
+def is_numeric_row(lineSplit, columns):
+	return all(col < len(lineSplit) and is_number(lineSplit[col]) for col in columns)
 
-	return delimiter
+def read_cached(filename, columns, cache_dir, delimiter=None):
+	# read_2d_file, through a cache of .npz files named by the path and
+	# columns read. Each entry holds the size and mtime of the file it was
+	# parsed from, so a changed file is parsed again and its entry replaced
+	if cache_dir is None:
+		return read_2d_file(filename, columns, delimiter)
 
-	
+	stat = os.stat(filename)
+	key = np.array([stat.st_size, stat.st_mtime_ns])
+	name = hashlib.sha1(f'{os.path.abspath(filename)}|{columns[0]},{columns[1]}'.encode()).hexdigest()
+	path = os.path.join(cache_dir, name + '.npz')
 
-def try_delimiter(delimiter, line):
-	if delimiter in line:
-		return True
-	else:
-		return False
+	try:
+		with np.load(path) as cached:
+			if np.array_equal(cached['key'], key):
+				x, y = cached['x'], cached['y']
+				# the mtime of an entry is when it was last used
+				os.utime(path)
+				return x, y
+	except (OSError, ValueError, KeyError):
+		pass
+
+	x, y = read_2d_file(filename, columns, delimiter)
+
+	# workers may write at once, so each writes its own temporary file
+	tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+	try:
+		with open(tmp, 'wb') as f:
+			np.savez(f, key=key, x=x, y=y)
+		os.replace(tmp, path)
+	except OSError:
+		pass
+
+	return x, y
+
+def prune_cache(cache_dir, limit):
+	entries = []
+	for entry in os.scandir(cache_dir):
+		if entry.name.endswith('.npz'):
+			stat = entry.stat()
+			entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+	# remove the least recently used entries until the rest fit
+	total = sum(size for _, size, _ in entries)
+	for _, size, path in sorted(entries):
+		if total <= limit:
+			break
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+		total -= size
 
 def is_number(value):
 	try:
@@ -101,7 +244,7 @@ def is_number(value):
 
 def pandas_read_file(filename, args):
 	column_labels = args.pandas
-	skiprows = eval(args.skiprows)
+	skiprows = ast.literal_eval(args.skiprows)
 
 	if '.xlsx' in filename or '.xls' in filename:
 		datafile = pd.read_excel(filename, skiprows=skiprows)
@@ -140,67 +283,421 @@ def wire_read_file(filename):
 	return x, y
 
 
+# ---------- Expressions ---------------------------------------
+
+# names expressions can use besides their variables. np is limited to the same
+# functions, so e.g. np.save or np.load aren't reachable
+NUMPY_NAMES = ['abs', 'absolute', 'sqrt', 'cbrt', 'square', 'exp', 'exp2', 'expm1',
+	'log', 'log10', 'log2', 'log1p', 'power', 'sign', 'mod', 'fmod', 'hypot', 'reciprocal',
+	'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'sinh', 'cosh', 'tanh', 'sinc',
+	'radians', 'degrees', 'deg2rad', 'rad2deg', 'floor', 'ceil', 'round', 'rint', 'trunc',
+	'clip', 'where', 'minimum', 'maximum', 'isfinite', 'isnan', 'isinf', 'isclose', 'nan_to_num',
+	'logical_and', 'logical_or', 'logical_not', 'real', 'imag', 'angle',
+	'mean', 'average', 'median', 'std', 'var', 'sum', 'prod', 'cumsum', 'cumprod', 'ptp',
+	'amax', 'amin', 'argmax', 'argmin', 'count_nonzero', 'percentile', 'quantile',
+	'nanmax', 'nanmin', 'nanmean', 'nanmedian', 'nanstd', 'nansum', 'nanargmax', 'nanargmin',
+	'nanpercentile', 'diff', 'gradient', 'interp', 'polyfit', 'polyval', 'trapezoid',
+	'convolve', 'correlate', 'histogram', 'sort', 'argsort', 'searchsorted', 'unique', 'flip',
+	'roll', 'concatenate', 'array', 'asarray', 'zeros', 'ones', 'full', 'linspace', 'arange',
+	'ones_like', 'zeros_like', 'full_like', 'pi', 'e', 'inf', 'nan']
+# reached as np.max etc. only, the plain names are python's, which take
+# several values (max(x, 0)) where numpy's would take an axis
+NUMPY_ONLY_NAMES = ['max', 'min', 'any', 'all']
+BUILTIN_NAMES = ['abs', 'all', 'any', 'bool', 'float', 'int', 'len', 'max', 'min', 'range',
+	'round', 'sorted', 'str', 'sum']
+
+NAMESPACE = {name: getattr(np, name) for name in NUMPY_NAMES}
+NAMESPACE.update({name: getattr(builtins, name) for name in BUILTIN_NAMES if name not in NAMESPACE})
+NAMESPACE['np'] = NAMESPACE['numpy'] = type('numpy', (), {name: staticmethod(getattr(np, name))
+	if callable(getattr(np, name)) else getattr(np, name) for name in NUMPY_NAMES + NUMPY_ONLY_NAMES})
+
+# the variables each option's expression can use, and whether it runs on
+# whole arrays
+EXPRESSIONS = {
+	'x_lambda': (['x', 'y', 'data', 'file', 'i'], True),
+	'y_lambda': (['x', 'y', 'data', 'file', 'i'], True),
+	'wherex': (['x', 'y', 'c', 'data', 'file', 'i'], True),
+	'wherey': (['x', 'y', 'c', 'data', 'file', 'i'], True),
+	'wherec': (['x', 'y', 'c', 'data', 'file', 'i'], True),
+	'equation': (['x'], True),
+	'legend_lambda': (['file', 'i'], False),
+	'sort_lambda': (['file'], False),
+	'time_series_x_lambda': (['file', 'i'], False),
+}
+
+ALLOWED_NODES = (ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Attribute,
+	ast.Subscript, ast.Slice, ast.Tuple, ast.List, ast.BinOp, ast.UnaryOp, ast.BoolOp,
+	ast.Compare, ast.IfExp, ast.Call, ast.keyword, ast.JoinedStr, ast.FormattedValue,
+	ast.operator, ast.unaryop, ast.boolop, ast.cmpop)
+
+# methods that write files
+BLOCKED_ATTRIBUTES = ['tofile', 'dump', 'dumps']
+
+def plain_fields(template):
+	# str.format looks up the attributes and items named in its fields, e.g.
+	# '{0.__class__}', where check() can't see them. Only allow plain fields
+	try:
+		for _, field, spec, _ in string.Formatter().parse(template):
+			if field and ('.' in field or '[' in field):
+				return False
+			if spec and not plain_fields(spec):
+				return False
+	except ValueError:
+		return False
+	return True
+
+class ExpressionError(ValueError):
+	pass
+
+class Vectorize(ast.NodeTransformer):
+	# and/or/not, chained comparisons and if/else only work on single values,
+	# so they are rewritten as the numpy functions that do the same on arrays
+
+	def call(self, name, args):
+		return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[])
+
+	def visit_BoolOp(self, node):
+		self.generic_visit(node)
+		name = '_and' if isinstance(node.op, ast.And) else '_or'
+		result = node.values[0]
+		for value in node.values[1:]:
+			result = self.call(name, [result, value])
+		return result
+
+	def visit_UnaryOp(self, node):
+		self.generic_visit(node)
+		if isinstance(node.op, ast.Not):
+			return self.call('_not', [node.operand])
+		return node
+
+	def visit_Compare(self, node):
+		self.generic_visit(node)
+		if len(node.ops) == 1:
+			return node
+
+		operands = [node.left] + node.comparators
+		result = None
+		for op, left, right in zip(node.ops, operands[:-1], operands[1:]):
+			pair = ast.Compare(left=left, ops=[op], comparators=[right])
+			result = pair if result is None else self.call('_and', [result, pair])
+		return result
+
+	def visit_IfExp(self, node):
+		self.generic_visit(node)
+		return self.call('_where', [node.test, node.body, node.orelse])
+
+VECTOR_NAMESPACE = {'_and': np.logical_and, '_or': np.logical_or,
+	'_not': np.logical_not, '_where': np.where}
+
+class Expression():
+	'''
+	An expression from the command line, parsed, checked and compiled once
+	and then evaluated for every file. Only the option's variables and the
+	names in NAMESPACE can be used, and names starting with an underscore
+	can't be reached.
+	'''
+	def __init__(self, option, text):
+		self.option = option
+		self.text = text
+		self.variables, self.vectorized = EXPRESSIONS[option]
+
+		try:
+			tree = ast.parse(text.strip(), mode='eval')
+		except SyntaxError as e:
+			raise self.error(f'is not a valid expression ({e.msg})')
+
+		self.check(tree)
+
+		if option == 'equation':
+			# written as maths, so e^x means e**x
+			tree = ReplacePower().visit(tree)
+		if self.vectorized:
+			tree = Vectorize().visit(tree)
+		ast.fix_missing_locations(tree)
+
+		self.code = compile(tree, f'--{option}', 'eval')
+		# numpy imports lazily through the caller's builtins. Expressions can't
+		# name __import__ themselves, check() rejects names starting with _
+		self.namespace = dict(NAMESPACE, __builtins__={'__import__': builtins.__import__})
+		if self.vectorized:
+			self.namespace.update(VECTOR_NAMESPACE)
+
+	def error(self, message):
+		return ExpressionError(f'--{self.option} "{self.text}" {message}')
+
+	def check(self, tree):
+		for node in ast.walk(tree):
+			if isinstance(node, (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+				raise self.error('loops over single values. Write it for whole arrays, '
+					'e.g. x*2 instead of [v*2 for v in x]')
+			if isinstance(node, ast.Lambda):
+				raise self.error('should be just the expression, e.g. data > 5 instead of lambda data: data > 5')
+			if not isinstance(node, ALLOWED_NODES):
+				raise self.error(f'uses {type(node).__name__}, which isn\'t allowed')
+
+			if isinstance(node, ast.Name) and node.id not in self.variables and node.id not in NAMESPACE:
+				raise self.error(f'uses unknown name {node.id}. Available are {", ".join(self.variables)} '
+					'and numpy functions like sqrt, exp, log, sin, where')
+			if isinstance(node, ast.Attribute) and (node.attr.startswith('_') or node.attr in BLOCKED_ATTRIBUTES):
+				raise self.error(f'uses .{node.attr}, which isn\'t allowed')
+			if isinstance(node, ast.Attribute) and node.attr in ('format', 'format_map') and not (
+					isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+					and plain_fields(node.value.value)):
+				raise self.error(f'can only use .{node.attr} on a string written in the expression, '
+					'with plain fields like {} or {0}. f-strings work too')
+			if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) \
+					and node.value.id in ('np', 'numpy') and node.attr not in NUMPY_NAMES + NUMPY_ONLY_NAMES:
+				raise self.error(f'uses {node.value.id}.{node.attr}, which isn\'t available. '
+					f'Available numpy names are {", ".join(NUMPY_NAMES + NUMPY_ONLY_NAMES)}')
+
+	def __call__(self, **values):
+		try:
+			return eval(self.code, self.namespace, values)
+		except ExpressionError:
+			raise
+		except Exception as e:
+			raise self.error(f'failed: {type(e).__name__}: {e}') from e
+
+	def array(self, size=None, **values):
+		# for expressions that must give one value per point
+		result = np.asarray(self(**values))
+		if result.ndim != 1 or (size is not None and len(result) != size):
+			raise self.error(f'must give one value per data point, it gave shape {result.shape}')
+		return result
+
+	def mask(self, size, **values):
+		result = self.array(size, **values)
+		if result.dtype != bool:
+			raise self.error('must give True/False for each point, e.g. data > 5')
+		return result
+
+class ReplacePower(ast.NodeTransformer):
+	def visit_BinOp(self, node):
+		self.generic_visit(node)
+		if isinstance(node.op, ast.BitXor):
+			node.op = ast.Pow()
+		return node
+
+@functools.lru_cache(maxsize=None)
+def expression(option, text):
+	# compiled once per process, worker processes compile their own
+	return Expression(option, text)
+
+def check_expressions(options):
+	for option in EXPRESSIONS:
+		text = getattr(options, option, None)
+		if text:
+			expression(option, text)
+
+
 # ---------- Program Functions ---------------------------------
 
+# data is passed through these as numpy arrays. The arrays may be shared,
+# e.g. the background, so each step returns a new array
+
 def offset_data(data, offset):
-	return [datum+offset for datum in data]
+	return data + offset
 
 def normalize_data(data):
-	normalizer = max(data)
-	return [datum/normalizer for datum in data]
+	normalizer = np.nanmax(data)
+	return data / normalizer
 
-def integrate(x, y, _range):
+def between(x, _range):
 	start, end = _range
+	return (x >= start) & (x <= end)
 
-	if type(x) == list:
-		_x = pd.DataFrame(x)
-		_y = pd.DataFrame(y)
-	
-
-	rows = _x[0].between(start, end)
+def integrate(x, y, _range):
+	rows = between(x, _range)
 
-	area = np.trapezoid(_y[0][rows], x=_x[0][rows])
+	area = np.trapezoid(y[rows], x=x[rows])
 
 	return area
 
 
 def ddx(x, y):
-	dx = []
-	dy = []
-	for i in range((len(x)-1)):
-		dy.append( (y[i+1] - y[i]) / (x[i+1] - x[i]) )
-		dx.append(x[i])
+	dy = np.diff(y) / np.diff(x)
+	dx = x[:-1]
 
 	return dx, dy
 
+@functools.lru_cache(maxsize=16)
+def als_penalty(L, lam):
+	# lam*D·Dᵀ is pentadiagonal and symmetric, so it's kept as its upper
+	# bands, the form solveh_banded takes. It only depends on the length and
+	# lam, so it's built once for all files on the same grid
+	D = sparse.diags([1,-2,1],[0,-1,-2], shape=(L,L-2), dtype=float)
+	DDT = D.dot(D.transpose()).tocsr()
+
+	bands = np.zeros((3, L))
+	bands[0, 2:] = DDT.diagonal(2)
+	bands[1, 1:] = DDT.diagonal(1)
+	bands[2] = DDT.diagonal(0)
+	bands *= lam
+	bands.flags.writeable = False
+
+	return bands
+
 def baseline_als(y, lam, p, niter=10):
+	y = np.asarray(y, dtype=float)
 	L = len(y)
-	D = sparse.diags([1,-2,1],[0,-1,-2], shape=(L,L-2))
+	penalty = als_penalty(L, lam)
+	Z = np.empty_like(penalty)
 	w = np.ones(L)
 	for i in range(niter):
-		W = sparse.spdiags(w, 0, L, L)
-		Z = W + lam *D.dot(D.transpose())
-		z = spsolve(Z, w*y)
-		w = p * (y > z) + (1-p) * (y < z)
+		# W + lam*D·Dᵀ, W only adds to the main diagonal
+		Z[:2] = penalty[:2]
+		np.add(penalty[2], w, out=Z[2])
+		try:
+			z = solveh_banded(Z, w*y, overwrite_ab=True, check_finite=False)
+		except np.linalg.LinAlgError:
+			# non-finite or degenerate data, which the sparse solver gave NaN for
+			return np.full(L, np.nan)
+
+		# the weights are all the next solve depends on, so once they stop
+		# changing z won't either
+		w_new = p * (y > z) + (1-p) * (y < z)
+		if np.array_equal(w_new, w):
+			break
+		w = w_new
 
 	return z
 
 
+def load_file(file, i, options, y_bkgd=None, delimiter=None):
+	'''
+	Reads a data file and applies the per-file processing that comes
+	before plotting. Runs in a worker thread or process. delimiter is only
+	given for files whose delimiter had to be asked for.
+
+	Returns x, y and c (None unless a pandas color column is used).
+	'''
+	c = None
+
+	if options.pandas[0] != '':
+		if options.inverse:
+			y, x, c = pandas_read_file(file, options)
+		else:
+			x, y, c = pandas_read_file(file, options)
+
+	else:
+		if file[-4:] == '.wdf':
+			x, y = wire_read_file(file)
+
+		elif options.inverse:
+			y, x = read_cached(file, options.columns, options.cache_dir, delimiter)
+		else:
+			x, y = read_cached(file, options.columns, options.cache_dir, delimiter)
+
+	# pandas columns may be lists
+	x = np.asarray(x)
+	y = np.asarray(y)
+
+	if options.x_lambda:
+		x = expression('x_lambda', options.x_lambda).array(x=x, y=y, data=x, file=file, i=i)
+
+	if options.y_lambda:
+		y = expression('y_lambda', options.y_lambda).array(x=x, y=y, data=y, file=file, i=i)
+
+	if c is not None:
+		c = np.asarray(c)
+
+	if options.subtract_file:
+		n = min(len(y), len(y_bkgd))
+		y = y[:n] - y_bkgd[:n]
+		x = x[:n]
+
+	if options.als_baseline:
+		lam, p = options.als_baseline
+		y = baseline_als(y, lam, p)
+
+	if options.normalize:
+		y = normalize_data(y)
+
+	if options.normalize_area[0] != options.normalize_area[1]:
+		area = integrate(x, y, options.normalize_area)
+
+		y = y / area
+
+	if options.detrend > -1:
+		# get first and last 5 elements
+		x_fit = np.concatenate([x[:5], x[-5:]])
+		y_fit = np.concatenate([y[:5], y[-5:]])
+
+		# fit polynomial
+		coefs = np.polyfit(x_fit, y_fit, options.detrend)
+
+		# subtract polynomial fit
+		y_fit = np.polyval(coefs, x)
+
+		y = np.subtract(y, y_fit)
+
+	return x, y, c
+
+def load_files(files, options, y_bkgd=None):
+	# loads files a few ahead of the one being plotted and yields them in
+	# order, so slow reads overlap with each other and with plotting
+	# baselining is cpu bound, so it always gets processes
+	if options.processes or options.als_baseline:
+		jobs = options.jobs or os.cpu_count() or 1
+		executor = ProcessPoolExecutor(max_workers=jobs)
+	else:
+		# threads mostly wait on disk or network, so use more than the cpus
+		jobs = options.jobs or min(32, (os.cpu_count() or 1) + 4)
+		executor = ThreadPoolExecutor(max_workers=jobs)
+
+	def result(file, i, future):
+		try:
+			return future.result()
+		except DelimiterNotFound as e:
+			# prompts only come from here, one at a time and in file order
+			delimiter = ask_delimiter(e.filename, e.sample)
+			return pool.submit(load_file, file, i, options, y_bkgd, delimiter).result()
+
+	with executor as pool:
+		window = 2 * jobs
+		queue = deque()
+		for i, file in enumerate(files):
+			if file.lower() == "none":
+				continue
+
+			queue.append((file, i, pool.submit(load_file, file, i, options, y_bkgd)))
+			if len(queue) >= window:
+				yield result(*queue.popleft())
+
+		while queue:
+			yield result(*queue.popleft())
+
+
 # ---------- Main Program --------------------------------------
 
 def main(files, options):
 
+	if options.no_cache:
+		options.cache_dir = None
+	else:
+		options.cache_dir = os.path.expanduser(options.cache_dir)
+		try:
+			os.makedirs(options.cache_dir, exist_ok=True)
+		except OSError:
+			options.cache_dir = None
+
+	y_bkgd = None
 	if options.subtract_file:
-		x_bkgd, y_bkgd = read_2d_file(options.subtract_file, options.columns)
+		try:
+			x_bkgd, y_bkgd = read_cached(options.subtract_file, options.columns, options.cache_dir)
+		except DelimiterNotFound as e:
+			delimiter = ask_delimiter(e.filename, e.sample)
+			x_bkgd, y_bkgd = read_cached(options.subtract_file, options.columns, options.cache_dir, delimiter)
 
+		file = options.subtract_file
 		if options.x_lambda:
-			x_bkgd = eval(options.x_lambda.replace('x', 'x_bkgd').replace('y', 'y_bkgd'))
+			x_bkgd = expression('x_lambda', options.x_lambda).array(x=x_bkgd, y=y_bkgd, data=x_bkgd, file=file, i=0)
 		if options.y_lambda:
-			y_bkgd = eval(options.y_lambda.replace('x', 'x_bkgd').replace('y', 'y_bkgd'))
+			y_bkgd = expression('y_lambda', options.y_lambda).array(x=x_bkgd, y=y_bkgd, data=y_bkgd, file=file, i=0)
 
 	if options.sort_lambda:
-		sort_func = lambda file : float(eval(options.sort_lambda))
-		files.sort(key=sort_func)
+		sort_func = expression('sort_lambda', options.sort_lambda)
+		files.sort(key=lambda file : float(sort_func(file=file)))
 
 	if not options.title:
 		title = '-'.join(files[0].split('.')[:-1])
@@ -231,8 +728,10 @@ def main(files, options):
 
 	if options.equation:
 		x = np.linspace(options.range[0], options.range[1])
-		y = eval(options.equation)
-		ax.plot(x, y)
+		y = expression('equation', options.equation)(x=x)
+		ax.plot(x, np.broadcast_to(y, x.shape))
+
+	loaded = load_files(files, options, y_bkgd)
 
 	legend = []
 	for i, file in enumerate(files):
@@ -245,8 +744,8 @@ def main(files, options):
 			legend.append(label)
 
 		elif options.legend_lambda:
-			label = lambda file : eval(options.legend_lambda)
-			legend.append(label(file))
+			label = expression('legend_lambda', options.legend_lambda)
+			legend.append(label(file=file, i=i))
 		elif options.legend_labels:
 			try:
 				legend.append(options.legend_labels[i])
@@ -260,61 +759,7 @@ def main(files, options):
 			# legendFilename = legendFilename[options.legend_start_cutoff:options.legend_end_cutoff]
 			legend.append(legendFilename)
 
-		x = []
-		y = []
-
-		if options.pandas[0] != '':
-			if options.inverse:
-				y, x, c = pandas_read_file(file, options)
-			else:
-				x, y, c = pandas_read_file(file, options)
-
-		else:
-			if file[-4:] == '.wdf':
-				x, y = wire_read_file(file)
-
-			elif options.inverse:
-				y, x = read_2d_file(file, options.columns)
-			else:
-				x, y = read_2d_file(file, options.columns)
-
-		if options.x_lambda:
-			x = eval(options.x_lambda)
-
-		if options.y_lambda:
-			y = eval(options.y_lambda)
-
-		if options.subtract_file:
-			y = [_y - _y_bkgd for _y, _y_bkgd in zip(y, y_bkgd)]
-			x = x[:len(y)]
-
-		
-		if options.als_baseline:
-			lam, p = options.als_baseline
-			y = baseline_als(y, lam, p)
-
-		if options.normalize:
-			y = normalize_data(y)
-
-		if options.normalize_area[0] != options.normalize_area[1]:
-			area = integrate(x, y, options.normalize_area)
-
-			y = [datum/area for datum in y]
-
-		if options.detrend > -1:
-			# get first and last 5 elements
-			x_fit = x[:5]
-			x_fit.extend(x[-5:])
-			y_fit = y[:5]
-			y_fit.extend(y[-5:])
-
-			# fit polynomial
-			coefs = np.polyfit(x_fit, y_fit, options.detrend)
-
-			# subtract polynomial fit
-			y_fit = np.polyval(coefs, x)
-
-			y = np.subtract(y, y_fit)
+		x, y, c = next(loaded)
 
 		if options.polyfit > -1:
 
@@ -376,7 +821,7 @@ def main(files, options):
 
 			y /= norm_area
 			if options.time_series_x_lambda:
-				x = eval(options.time_series_x_lambda)
+				x = expression('time_series_x_lambda', options.time_series_x_lambda)(file=file, i=i)
 			else:
 				x = i
 			if not options.xlabel:
@@ -392,49 +837,17 @@ def main(files, options):
 			for n in range(options.differentiate):
 				x, y, = ddx(x, y)
 
-		if options.wherex:
-			where = lambda data: eval(options.wherex)
-			rows = [j for j, data in enumerate(x) if where(data)]
-			_x, _y = [], []
-			if c is not None:
-				_c = []
-			for row in rows:
-				_x.append(x[row])
-				_y.append(y[row])
-				if c is not None:
-					_c.append(c[row])
-			x = _x
-			y = _y
-			if c is not None:
-				c = _c
+		for text, values in [(options.wherex, 'x'), (options.wherey, 'y'), (options.wherec, 'c')]:
+			if not text:
+				continue
+			assert values != 'c' or c is not None, '--wherec needs a color column, see --color_col'
 
-		if options.wherey:
-			where = lambda data: eval(options.wherey)
-			rows = [j for j, data in enumerate(y) if where(data)]
-			_x, _y = [], []
-			if c is not None:
-				_c = []
-			for row in rows:
-				_x.append(x[row])
-				_y.append(y[row])
-				if c is not None:
-					_c.append(c[row])
-			x = _x
-			y = _y
+			rows = expression('where' + values, text).mask(len(x), x=x, y=y, c=c,
+				data={'x': x, 'y': y, 'c': c}[values], file=file, i=i)
+			x = x[rows]
+			y = y[rows]
 			if c is not None:
-				c = _c
-
-		if options.wherec:
-			where = lambda data: eval(options.wherec)
-			rows = [j for j, data in enumerate(c) if where(data)]
-			_x, _y, _c = [], [], []
-			for row in rows:
-				_x.append(x[row])
-				_y.append(y[row])
-				_c.append(c[row])
-			x = _x
-			y = _y
-			c = _c
+				c = c[rows]
 
 		if options.offset != 0:
 			offset = options.offset * i
@@ -462,16 +875,17 @@ def main(files, options):
 
 		if options.integrate[0] != options.integrate[1]:
 			area = integrate(x, y, options.integrate)
-			_x = pd.DataFrame(x)
-			_y = pd.DataFrame(y)
-			rows = _x[0].between(options.integrate[0], options.integrate[1])
-			ax.fill_between(_x[0][rows], _y[0][rows], color='tab:gray', alpha=0.6, linewidth=0)
+			rows = between(x, options.integrate)
+			ax.fill_between(x[rows], y[rows], color='tab:gray', alpha=0.6, linewidth=0)
 
 			_, xmax = ax.get_xlim()
 			_, ymax = ax.get_ylim()
 			ax.text(xmax*0.85, ymax*0.85, f'area: {area}', ha='right', bbox=dict(boxstyle='round', ec=(0, 0, 0), fc=(0.95, 0.95, 0.95)))
 
 
+	if options.cache_dir:
+		prune_cache(options.cache_dir, options.cache_size * 2**20)
+
 	if options.hlines:
 		for line in options.hlines:
 			ax.axhline(y=line, color='k', linestyle=options.hline_style)
@@ -563,7 +977,7 @@ if __name__ == '__main__':
 	parser.add_argument('--legend_iterator', type=str, help='iterated labels to use in the legend for each dataset ', default='')
 	# parser.add_argument('--legend_start_cutoff', type=int, help='character to start cutoff of filenames for legend', default=0)
 	# parser.add_argument('--legend_end_cutoff', type=int, help='character to end cutoff of filenames for legend', default=-1)
-	parser.add_argument('--legend_lambda', type=str, help='specify a lambda {file} function to parse filenames for legend labels', default='')
+	parser.add_argument('--legend_lambda', type=str, help='expression of {file} (and {i}) to make legend labels from filenames, e.g. file.split("_")[0]', default='')
 	parser.add_argument('--legend_labels', type=str, nargs='+', help='specific labels for legend. Number of labels passed must be same as number of files')
 	parser.add_argument('--no_legend', action='store_true', help='don\'t display a legend')
 	parser.add_argument('--legend_columns', type=int, help='number of columns to use for legend', default=1)
@@ -574,7 +988,12 @@ if __name__ == '__main__':
 	parser.add_argument('--presentation', action='store_true', help='increase font size for use in slides')
 	parser.add_argument('--inverse', action='store_true', help='flip x and y')
 	parser.add_argument('--columns', nargs=2, default=[0, 1], type=int, help='columns of data file to read, 0-indexed')
-	parser.add_argument('--sort_lambda', type=str, help='lambda {file} function to parse filenames to sort files', default='')
+	parser.add_argument('-j', '--jobs', type=int, help='number of files to read at once. Defaults to a few more than the number of cpus')
+	parser.add_argument('--processes', action='store_true', help='read files in worker processes instead of threads. Always used with --als_baseline')
+	parser.add_argument('--cache_dir', default='~/.cache/quickplot', help='where parsed data files are kept between runs')
+	parser.add_argument('--no_cache', action='store_true', help='parse every file and don\'t keep the data')
+	parser.add_argument('--cache_size', type=int, default=1024, help='maximum size of the cache in MB')
+	parser.add_argument('--sort_lambda', type=str, help='expression of {file} giving a number to sort files by, e.g. float(file[:3])', default='')
 	parser.add_argument('--hlines', nargs='+', type=float, help='draw horizontal lines at locations')
 	parser.add_argument('--hline_style', type=str, default='-', help='pyplot style for hlines')
 	parser.add_argument('--vlines', nargs='+', type=float, help='draw vertical lines at locations')
@@ -590,18 +1009,18 @@ if __name__ == '__main__':
 	parser.add_argument('--poly_coef_loc', choices=['topright', 'topleft', 'bottomright', 'bottomleft', 'centerright', 'centerleft'], default='topright', help='location to draw fit parameters')
 	parser.add_argument('--hide_poly_coef', action='store_false', help='hide text box with polynomial coefficients')
 	parser.add_argument('--peak_area_over_time', nargs=2, default=[0,0], type=float, help='integrate an area of data and plot area as time series')
-	parser.add_argument('--time_series_x_lambda', type=str, help='lambda {file} function to parse filename for x value in time series integral')
+	parser.add_argument('--time_series_x_lambda', type=str, help='expression of {file} (and {i}) giving the x value in time series integral')
 	parser.add_argument('--time_series_normalize', action='store_true', help='normalize peak area. First area = 1')
-	parser.add_argument('--equation', help='equation to plot as f(x). Example: e^x. Specify --range')
+	parser.add_argument('--equation', help='equation to plot as f(x). Example: e^x or sin(x)/x. Specify --range')
 	parser.add_argument('--range', nargs=2, default=[-10, 10], type=float, help='range for custom --equation to be plotted over')
 	parser.add_argument('--integrate', nargs=2, default=[0,0], type=float, help='integrate an area of data between two points')
 	parser.add_argument('--subtract_file', type=str, help='subtract data from all others. Useful for backgrounds')
 	parser.add_argument('--als_baseline', type=float, nargs=2, help='asymmetric least squares baselining. Args LAMBDA and P')
-	parser.add_argument('--x_lambda', help='lambda {data} to process x data. data stored as list')
-	parser.add_argument('--y_lambda', help='lambda {data} to process y data. data stored as list')
-	parser.add_argument('--wherex', help='lambda {data} only plot points where this operation on x evaluates true')
-	parser.add_argument('--wherey', help='lambda {data} only plot points where this operation on y evaluates true')
-	parser.add_argument('--wherec', help='lambda {data} only plot points where this operation on c evaluates true')
+	parser.add_argument('--x_lambda', help='expression of {data} (or x, y) to process x data. data is a numpy array, e.g. data*1e3')
+	parser.add_argument('--y_lambda', help='expression of {data} (or x, y) to process y data. data is a numpy array, e.g. log10(data)')
+	parser.add_argument('--wherex', help='expression of {data} (x values) giving True for points to plot, e.g. "data > 500 and data < 2000"')
+	parser.add_argument('--wherey', help='expression of {data} (y values) giving True for points to plot')
+	parser.add_argument('--wherec', help='expression of {data} (color values) giving True for points to plot')
 
 
 	# pandas stuff
@@ -623,6 +1042,11 @@ if __name__ == '__main__':
 	if '*' in args.data_files[0] or '?' in args.data_files[0]:
 		args.data_files = find_files(args.data_files[0])
 
+	try:
+		check_expressions(args)
+	except ExpressionError as e:
+		parser.error(str(e))
+
 	if args.savefig:
 		args.savefile = args.savefig
 
@@ -645,10 +1069,13 @@ if __name__ == '__main__':
 
 	files = args.data_files
 
-	if args.xkcd:
-		with plt.xkcd():
+	try:
+		if args.xkcd:
+			with plt.xkcd():
+				main(files, args)
+		else:
 			main(files, args)
-	else:
-		main(files, args)
+	except ExpressionError as e:
+		parser.error(str(e))
 
 
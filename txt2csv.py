@@ -1,41 +1,442 @@
 '''
 Creates a comma-separated copy of a tab- or space-delimited file
 
-Usage: argv-based
+Input is streamed in large blocks, so multi-GB logs convert at close
+to disk speed without being held in memory. Space-delimited input has
+runs of whitespace collapsed into a single comma, so padded instrument
+columns don't turn into strings of empty fields. Header lines are
+converted along with the data.
+
+Any number of files, globs, or directories can be given; they are
+converted in parallel. A manifest of input sizes and modification times
+is kept so files that haven't changed since their last conversion are
+skipped. Delimiters are guessed from a sample of each file, never by
+prompting.
+
+Data can also be written as binary arrays so other scripts can load it
+without parsing text: .npy (one float64 array, memory-mappable with
+np.load(file, mmap_mode='r')), .npz (one array per named column), or
+.parquet (column types inferred from the first block, with integer
+columns stored as float64, needs pyarrow).
+
+Usage: argparse-based, - reads stdin / writes stdout
 
 > python txt2csv.py file
+> python txt2csv.py file -o out.csv
+> python txt2csv.py 'runs/*.txt' exports/ -o converted/
+> python txt2csv.py big_log.txt -f npy
+> cat file | python txt2csv.py - > out.csv
 '''
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import importlib.util
+import json
+import os
 import sys
 
-def txtDelimiter(filename):
-	with open(filename) as f:
-		line = f.readline()
-	f.close()
+BLOCK_SIZE = 1 << 22 # bytes read per block
+SAMPLE_SIZE = 1 << 16 # bytes used to guess the delimiter
+SAMPLE_LINES = 50
+MANIFEST = '.txt2csv_manifest.json'
+
+
+def find_files(pattern, dir_pattern='*.txt'):
+	if '~' in pattern:
+		pattern = pattern.replace('~', os.environ['HOME'])
+
+	if os.path.isdir(pattern):
+		pattern = os.path.join(pattern, dir_pattern)
 
-	if '\t' in line:
-		return '\t'
-	elif ' ' in line:
-		return ' '
+	if '*' in pattern or '?' in pattern:
+		files = glob.glob(pattern)
 	else:
-		return input('Delimiter:\n')
+		files = [pattern]
+
+	return sorted(files)
+
+
+def find_delimiter(sample):
+	lines = [line for line in sample[:SAMPLE_SIZE].split(b'\n') if line.strip()]
+	# the last line may be cut off partway, and the first few may be headers,
+	# so judge on the back half of the complete lines
+	lines = lines[:-1] or lines
+	lines = lines[:SAMPLE_LINES]
+	lines = lines[len(lines)//2:]
+	if not lines:
+		return None
+
+	best, best_score = None, 0.5
+	for delim in [b'\t', b';', b',', b' ']:
+		if delim == b' ':
+			counts = [len(line.split()) for line in lines]
+		else:
+			counts = [len(line.split(delim)) for line in lines]
+
+		mode = max(set(counts), key=counts.count)
+		if mode < 2:
+			continue
+
+		score = counts.count(mode) / len(counts)
+		if score > best_score:
+			best, best_score = delim, score
+
+	return best
+
+
+def convert_block(block, delim):
+	if delim == b' ':
+		# bytes.split() with no separator collapses whitespace runs and strips line ends
+		return b'\n'.join(b','.join(line.split()) for line in block.split(b'\n'))
+	elif delim == b',' or delim is None:
+		return block
+	else:
+		return block.replace(delim, b',')
+
+
+def is_number(value):
+	try:
+		float(value)
+		return True
+	except ValueError:
+		return False
+
+
+def iter_blocks(src, delim=None, block_size=BLOCK_SIZE):
+	remainder = b''
+	sniffed = delim is not None
+
+	while True:
+		block = src.read(block_size)
+		if not block:
+			break
+
+		# only convert whole lines, carry the partial last line into the next block
+		block = remainder + block
+		cut = block.rfind(b'\n') + 1
+		if cut == 0:
+			remainder = block
+			continue
+		block, remainder = block[:cut], block[cut:]
+
+		if not sniffed:
+			delim = find_delimiter(block)
+			sniffed = True
+
+		yield convert_block(block, delim)
+
+	if remainder:
+		if not sniffed:
+			delim = find_delimiter(remainder)
+		yield convert_block(remainder, delim)
+
+
+def iter_data(blocks):
+	"""Splits header lines off the front of converted blocks.
+
+	Yields (column names, data block) pairs. Names are taken from the last
+	header line if it has one field per column, otherwise they are None.
+	"""
+	header = names = None
+	for block in blocks:
+		if header is not None:
+			yield header, block
+			continue
+
+		lines = block.split(b'\n')
+		for i, line in enumerate(lines):
+			fields = line.split(b',')
+			if any(is_number(field) for field in fields):
+				break
+			if line.strip():
+				names = [field.strip().decode(errors='replace') for field in fields]
+		else:
+			continue
+
+		if names is not None and len(names) != len(fields):
+			names = None
+		header = names
+		yield header, b'\n'.join(lines[i:])
+
+
+def write_npy_header(f, shape, dtype, header_len=118):
+	# fixed-size v1.0 header, so the row count can be filled in after streaming
+	header = "{{'descr': '{}', 'fortran_order': False, 'shape': {}, }}".format(
+		dtype.str, tuple(shape)).encode('latin1')
+	header = header.ljust(header_len - 1) + b'\n'
+	f.seek(0)
+	f.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header)
+
+
+def write_npy(blocks, dst):
+	import numpy as np
+	from io import BytesIO
+
+	dtype = np.dtype('<f8')
+	write_npy_header(dst, (0, 0), dtype)
+	n_rows, n_cols, names = 0, 0, None
+
+	for names, block in iter_data(blocks):
+		try:
+			data = np.loadtxt(BytesIO(block), delimiter=',', dtype=dtype, ndmin=2)
+		except ValueError as e:
+			raise ValueError(f'non-numeric data, use --format parquet ({e})') from None
+		if not data.size:
+			continue
+		if n_cols and data.shape[1] != n_cols:
+			raise ValueError(f'row {n_rows} has {data.shape[1]} columns, expected {n_cols}')
+
+		n_cols = data.shape[1]
+		n_rows += data.shape[0]
+		dst.write(data.tobytes())
+
+	write_npy_header(dst, (n_rows, n_cols), dtype)
+
+	return names
+
+
+def write_npz(blocks, outfile):
+	import numpy as np
+
+	tmp = outfile + '.npy.tmp'
+	try:
+		with open(tmp, 'wb') as f:
+			names = write_npy(blocks, f)
+
+		data = np.load(tmp, mmap_mode='r')
+		if names is None:
+			names = [f'col{i}' for i in range(data.shape[1])]
+		np.savez(outfile, **{name: data[:, i] for i, name in enumerate(names)})
+	finally:
+		if os.path.exists(tmp):
+			os.remove(tmp)
+
+
+def write_parquet(blocks, outfile):
+	import pyarrow as pa
+	from pyarrow import csv, parquet
+
+	writer = None
+	read_options = convert_options = None
+	try:
+		for names, block in iter_data(blocks):
+			if not block.strip():
+				continue
+
+			if writer is None:
+				# column types are inferred from the first block and fixed after that.
+				# integer and empty columns are widened to float64, so a later 1.5 or
+				# value in a column that started out blank still converts
+				read_options = csv.ReadOptions(column_names=names, autogenerate_column_names=names is None)
+				table = csv.read_csv(pa.py_buffer(block), read_options=read_options)
+				schema = pa.schema([field.with_type(pa.float64())
+					if pa.types.is_integer(field.type) or pa.types.is_null(field.type) else field
+					for field in table.schema])
+				table = table.cast(schema)
+				convert_options = csv.ConvertOptions(column_types=schema)
+				writer = parquet.ParquetWriter(outfile, schema)
+			else:
+				table = csv.read_csv(pa.py_buffer(block), read_options=read_options,
+					convert_options=convert_options)
+
+			writer.write_table(table)
+	finally:
+		if writer is not None:
+			writer.close()
+
+
+def convert(infile, outfile, delim=None, block_size=BLOCK_SIZE, fmt='csv'):
+	if infile != '-' and outfile != '-':
+		assert os.path.abspath(infile) != os.path.abspath(outfile), \
+		'output file {out} would overwrite input file'.format(out=outfile)
+
+	assert fmt == 'csv' or outfile != '-', 'only csv can be written to stdout'
+
+	if infile == '-':
+		src = sys.stdin.buffer
+	else:
+		src = open(infile, 'rb')
+
+	try:
+		blocks = iter_blocks(src, delim, block_size)
+
+		if fmt == 'npz':
+			write_npz(blocks, outfile)
+		elif fmt == 'parquet':
+			write_parquet(blocks, outfile)
+		elif outfile == '-':
+			for block in blocks:
+				sys.stdout.buffer.write(block)
+			sys.stdout.buffer.flush()
+		else:
+			with open(outfile, 'wb') as dst:
+				if fmt == 'npy':
+					write_npy(blocks, dst)
+				else:
+					for block in blocks:
+						dst.write(block)
+	except BaseException:
+		# don't leave a truncated file that looks like a finished conversion
+		if outfile != '-' and os.path.exists(outfile):
+			os.remove(outfile)
+		raise
+	finally:
+		if src is not sys.stdin.buffer:
+			src.close()
+
+
+def output_name(infile, outdir=None, fmt='csv'):
+	outfile = os.path.splitext(infile)[0] + '.' + fmt
+
+	if outdir:
+		outfile = os.path.join(outdir, os.path.basename(outfile))
+
+	return outfile
+
+
+# ---------- Manifest ------------------------------------------
+
+def file_key(filename):
+	stat = os.stat(filename)
+	return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_manifest(filename):
+	try:
+		with open(filename) as f:
+			return json.load(f)
+	except (FileNotFoundError, json.JSONDecodeError):
+		return {}
+
+
+def write_manifest(filename, manifest):
+	tmp = filename + '.tmp'
+	with open(tmp, 'w') as f:
+		json.dump(manifest, f, indent=1)
+	os.replace(tmp, filename)
+
+
+def is_current(manifest, infile, outfile, delim):
+	entry = manifest.get(os.path.abspath(infile))
+	if entry is None:
+		return False
+
+	return (entry['key'] == file_key(infile)
+		and entry['outfile'] == os.path.abspath(outfile)
+		and entry['delimiter'] == delim
+		and os.path.exists(outfile))
+
+
+def convert_file(infile, outfile, delim=None, block_size=BLOCK_SIZE, fmt='csv'):
+	# stat before reading, so a file that changes mid-conversion is redone next run
+	key = file_key(infile)
+	convert(infile, outfile, delim, block_size, fmt)
+	return infile, outfile, key
+
+
+def convert_files(files, outdir=None, delim=None, block_size=BLOCK_SIZE,
+		jobs=None, manifest_file=MANIFEST, force=False, fmt='csv'):
+
+	manifest = read_manifest(manifest_file) if manifest_file else {}
+	manifest_delim = delim.decode() if delim else None
+
+	if outdir:
+		os.makedirs(outdir, exist_ok=True)
+
+	todo = []
+	for infile in files:
+		outfile = output_name(infile, outdir, fmt)
+		if not force and is_current(manifest, infile, outfile, manifest_delim):
+			continue
+		todo.append((infile, outfile))
+
+	n_skipped = len(files) - len(todo)
+	if n_skipped:
+		print(f'Skipping {n_skipped} unchanged file(s)', file=sys.stderr)
+
+	failed = []
+	def record(infile, result):
+		try:
+			infile, outfile, key = result()
+		except (OSError, ValueError, AssertionError) as e:
+			failed.append(infile)
+			print(f'\n{infile}: {e}', file=sys.stderr)
+			return
+
+		manifest[os.path.abspath(infile)] = {'key': key,
+			'outfile': os.path.abspath(outfile), 'delimiter': manifest_delim}
+
+	if jobs == 1 or len(todo) < 2:
+		for infile, outfile in todo:
+			record(infile, lambda : convert_file(infile, outfile, delim, block_size, fmt))
+	else:
+		with ProcessPoolExecutor(max_workers=jobs) as pool:
+			futures = {pool.submit(convert_file, infile, outfile, delim, block_size, fmt): infile
+				for infile, outfile in todo}
+
+			for i, future in enumerate(as_completed(futures)):
+				print(f'Converted {i+1}/{len(todo)}', end='\r', file=sys.stderr)
+				record(futures[future], future.result)
+			print(file=sys.stderr)
+
+	if manifest_file:
+		write_manifest(manifest_file, manifest)
+
+	return len(todo) - len(failed), n_skipped, failed
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Convert tab- or space-delimited text to csv or binary arrays')
+	parser.add_argument('inputs', nargs='+', help='files, globs, or directories to convert. - for stdin')
+	parser.add_argument('-o', '--output', help='output file for a single input (- for stdout), otherwise output directory. Defaults to alongside each input with the extension of --format')
+	parser.add_argument('-d', '--delimiter', help='input delimiter. Use "tab" or "space" for whitespace. Guessed from a sample of each file if not given')
+	parser.add_argument('-f', '--format', choices=['csv', 'npy', 'npz', 'parquet'], default='csv', help='output format. npy is one float64 array, npz one array per column, parquet keeps column types')
+	parser.add_argument('--pattern', default='*.txt', help='files to convert when a directory is given')
+	parser.add_argument('-j', '--jobs', type=int, help='number of worker processes. Defaults to number of cpus')
+	parser.add_argument('--manifest', default=MANIFEST, help='manifest file used to skip unchanged inputs')
+	parser.add_argument('--no_manifest', action='store_true', help='don\'t read or write a manifest')
+	parser.add_argument('--force', action='store_true', help='convert all inputs even if unchanged')
+	parser.add_argument('--block_size', type=int, default=BLOCK_SIZE, help='bytes to read per block')
+
+	args = parser.parse_args()
+
+	delim = args.delimiter
+	if delim is not None:
+		delim = {'tab': '\t', 'space': ' '}.get(delim, delim).encode()
+
+	if args.format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+		print('pyarrow is required to write parquet files')
+		sys.exit()
+	elif args.format not in ('csv', 'parquet') and importlib.util.find_spec('numpy') is None:
+		print('numpy is required to write npy/npz files')
+		sys.exit()
+
+	if args.inputs == ['-']:
+		convert('-', args.output or '-', delim, args.block_size, args.format)
+		sys.exit()
 
+	files = []
+	for pattern in args.inputs:
+		files.extend(find_files(pattern, args.pattern))
 
-infile = sys.argv[1]
-if len(sys.argv) > 2:
-	outfile = sys.argv[2]
-else:
-	outfile = infile.replace('.txt', '.csv')
+	if not files:
+		print('No files found', file=sys.stderr)
+		sys.exit(1)
 
-dataRead = open(infile)
-dataWrite = open(outfile, 'w')
+	if len(files) == 1 and args.output and not os.path.isdir(args.output):
+		try:
+			convert(files[0], args.output, delim, args.block_size, args.format)
+		except (OSError, ValueError, AssertionError) as e:
+			print(f'{files[0]}: {e}', file=sys.stderr)
+			sys.exit(1)
+		sys.exit()
 
-if '.txt' in infile:
-	delim = txtDelimiter(infile)
-elif '.csv' in infile:
-	delim = ','
-else:
-	delim = input('Delimiter:')
+	manifest_file = None if args.no_manifest else args.manifest
+	n_converted, n_skipped, failed = convert_files(files, args.output, delim,
+		args.block_size, args.jobs, manifest_file, args.force, args.format)
 
-for line in dataRead:
-	dataWrite.write(line.replace(delim, ','))
\ No newline at end of file
+	print(f'Converted {n_converted}, skipped {n_skipped} unchanged', file=sys.stderr)
+	if failed:
+		sys.exit(1)